@@ -0,0 +1,130 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+# This file is part of the Waymarked Trails Map Project
+# Copyright (C) 2024 Sarah Hoffmann
+import pytest
+import shapely
+from shapely.testing import assert_geometries_equal
+
+from wmt_db.geometry.assembly import assemble_route, build_member_geometry, patch_route
+from wmt_db.geometry.member_loader import linestring_coords
+
+
+def _coords(g, points):
+    return shapely.get_coordinates(g.line(points))
+
+
+def _members(*members):
+    return [{'type': m[0], 'id': m[1], 'role': ''} for m in members]
+
+
+def test_member_geometry_ways_and_relations(grid):
+    g = grid('1 2 3 4 5 6')
+    data = {('W', 1): ({}, 10, _coords(g, '12'), None),
+            ('W', 2): ({}, 10, _coords(g, '23'), None),
+            ('R', 5): ('{}', shapely.MultiLineString([g.line('34'), g.line('56')]))}
+
+    geom = build_member_geometry(_members(('W', 1), ('R', 5), ('W', 2), ('W', 1), ('N', 3)),
+                                 data)
+
+    assert_geometries_equal(geom, shapely.MultiLineString(
+                                    [g.line('12'), g.line('34'), g.line('56'), g.line('23')]))
+
+
+def test_member_geometry_missing():
+    data = {('R', 5): ('{}', None)}
+
+    assert build_member_geometry(_members(('W', 1), ('R', 5)), data) is None
+    assert assemble_route(_members(('W', 1), ('R', 5)), data) is None
+
+
+def test_assemble_route(grid):
+    g = grid('1 2 3')
+    data = {('W', 1): ({}, 10, _coords(g, '12'), None),
+            ('W', 2): ({}, 10, _coords(g, '32'), None)}
+
+    geom, render_geom, route_json, route_data, linear = \
+        assemble_route(_members(('W', 1), ('W', 2)), data)
+
+    assert_geometries_equal(geom, g.line('123'))
+    assert linear == 'yes'
+    assert isinstance(route_json, str)
+    assert isinstance(route_data, bytes)
+
+
+@pytest.mark.parametrize('byte_order', [0, 1])
+def test_linestring_coords_from_wkb(grid, byte_order):
+    g = grid('1 2 3')
+    line = g.line('123')
+
+    coords = linestring_coords(shapely.to_wkb(line, byte_order=byte_order))
+
+    assert coords.tolist() == shapely.get_coordinates(line).tolist()
+
+
+def test_linestring_coords_from_other_wkb():
+    line = shapely.LineString([(0, 0, 1), (1, 2, 3)])
+
+    coords = linestring_coords(shapely.to_wkb(line, include_srid=False))
+
+    assert coords.tolist() == [[0, 0], [1, 2]]
+
+
+def _way_data(g, *ways):
+    return {('W', i): ({}, length, _coords(g, pts), None) for i, length, pts in ways}
+
+
+@pytest.mark.parametrize('line2', ['2783', '3872'])
+def test_patch_route_same_endpoints(grid, line2):
+    g = grid("""\
+        1 2   3 4 5
+           7 8
+        """)
+    members = _members(('W', 1), ('W', 2), ('W', 3), ('W', 4))
+    old_data = _way_data(g, (1, 10, '12'), (2, 10, '23'), (3, 10, '34'), (4, 10, '54'))
+    new_data = _way_data(g, (1, 10, '12'), (2, 25, line2), (3, 10, '34'), (4, 10, '54'))
+
+    old_route = assemble_route(members, old_data)
+    patched = patch_route(old_route[3], members, new_data, {2})
+    expected = assemble_route(members, new_data)
+
+    assert patched is not None
+    assert patched[2] == expected[2]
+    assert patched[4] == expected[4]
+    assert_geometries_equal(patched[0], expected[0])
+
+
+def test_patch_route_unchanged(grid):
+    g = grid("1 2 3")
+    members = _members(('W', 1), ('W', 2))
+    data = _way_data(g, (1, 10, '12'), (2, 10, '23'))
+
+    route = assemble_route(members, data)
+
+    assert patch_route(route[3], members, data, set())[2] == route[2]
+
+
+@pytest.mark.parametrize('line2', ['27', '72', '232'])
+def test_patch_route_changed_endpoints(grid, line2):
+    g = grid("""\
+        1 2   3 4
+           7
+        """)
+    members = _members(('W', 1), ('W', 2), ('W', 3))
+    old_data = _way_data(g, (1, 10, '12'), (2, 10, '23'), (3, 10, '34'))
+    new_data = _way_data(g, (1, 10, '12'), (2, 10, line2), (3, 10, '34'))
+
+    old_route = assemble_route(members, old_data)
+
+    assert patch_route(old_route[3], members, new_data, {2}) is None
+
+
+def test_patch_route_new_way(grid):
+    g = grid("1 2 3")
+    members = _members(('W', 1), ('W', 2))
+    old_data = _way_data(g, (1, 10, '12'))
+    new_data = _way_data(g, (1, 10, '12'), (2, 10, '23'))
+
+    old_route = assemble_route(members, old_data)
+
+    assert patch_route(old_route[3], members, new_data, {2}) is None
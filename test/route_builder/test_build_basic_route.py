@@ -122,3 +122,26 @@ def test_all_members_with_roles(grid):
              ]
         )
 
+
+
+@pytest.mark.parametrize('order', [(4, 0, 6, 2, 5, 1, 3), (6, 5, 4, 3, 2, 1, 0),
+                                   (1, 3, 5, 0, 2, 4, 6)])
+@pytest.mark.parametrize('reverse', [(), (0, 3), (2, 4, 6)])
+def test_sort_unordered_relations(grid, order, reverse):
+    g = grid("abcdefgh")
+    pieces = ['ab', 'bc', 'cd', 'de', 'ef', 'fg', 'gh']
+
+    members = []
+    for i in order:
+        line = pieces[i][::-1] if i in reverse else pieces[i]
+        sub = build_route([rt.BaseWay(i, {}, 10, 0, g.line(line), '')])
+        sub.role = ''
+        members.append(sub)
+
+    route = build_route(members)
+
+    assert route.linear == ('yes' if order == (6, 5, 4, 3, 2, 1, 0) else 'sorted')
+    assert len(route.main) == 7
+    for prev, nxt in zip(route.main, route.main[1:]):
+        assert prev.last == nxt.first
+    assert {route.first, route.last} == {tuple(g.coord('a')), tuple(g.coord('h'))}
@@ -55,6 +55,24 @@ class TestGetRelationObjectsWays:
         assert result.geom == g.line('12')
 
 
+    def test_precomputed_way_info(self, grid, mapdb):
+        g = grid('1 2')
+        mapdb.insert_into('ways')\
+            .line(1, geom=g.wkt_line('12'), tags={}, length=1234,
+                  endpoints=g.coord(1) + g.coord(2))
+
+        objs = self.run_test(mapdb, [(1, '')])
+
+        assert len(objs) == 1
+        assert objs[0].length == 1234
+        assert objs[0].endpoints == (tuple(g.coord(1)), tuple(g.coord(2)))
+
+        objs[0].reverse()
+        assert objs[0].first == tuple(g.coord(2))
+        assert objs[0].last == tuple(g.coord(1))
+        assert objs[0].geom == g.line('21')
+
+
     @pytest.mark.parametrize('role,direction', [('forward', 1),
                                                 ('backward', -1)])
     def test_oneway_way(self, grid, mapdb, role, direction):
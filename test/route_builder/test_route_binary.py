@@ -0,0 +1,221 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+# This file is part of the Waymarked Trails Map Project
+# Copyright (C) 2024 Sarah Hoffmann
+import struct
+
+import pytest
+
+import wmt_db.geometry.route_types as rt
+from wmt_db.geometry.route_binary import dump_route, load_route
+from wmt_db.geometry.route_builder import build_route
+from osgende.common.tags import TagStore
+
+
+def test_roundtrip_with_splits(grid):
+    g = grid("""\
+                7 8
+        1  2  3    4  5  6
+                 9
+        """)
+
+    route = rt.RouteSegment(
+        length=16, start=0, linear='yes', appendices=[],
+        main=[rt.WaySegment(
+                length=5, start=0,
+                ways=[rt.BaseWay(osm_id=1, tags=TagStore({'name': 'Ä'}), length=5,
+                                 start=0, direction=0, role='', geom=g.line('12'))]),
+              rt.SplitSegment(
+                length=6, start=5, first=tuple(g.coord(2)), last=tuple(g.coord(4)),
+                forward=[rt.WaySegment(
+                            length=6, start=5,
+                            ways=[rt.BaseWay(osm_id=2, tags=TagStore(), length=6, start=5,
+                                             direction=1, role='', geom=g.line('234'))])],
+                backward=[rt.WaySegment(
+                            length=6, start=5,
+                            ways=[rt.BaseWay(osm_id=3, tags=TagStore(), length=6, start=5,
+                                             direction=-1, role='', geom=g.line('2984'))])]),
+              ])
+
+    assert load_route(dump_route(route)) == route
+
+
+def test_roundtrip_with_subroutes_and_appendices(grid):
+    g = grid("""\
+        1 2 3 4 5
+              6 7
+        """)
+
+    sub = build_route([rt.BaseWay(osm_id=1, tags=TagStore(), length=5, start=0,
+                                  direction=0, role='', geom=g.line('123'))])
+    sub.id = 45
+    sub.role = ''
+
+    route = build_route([sub,
+                         rt.BaseWay(osm_id=2, tags=TagStore(), length=5, start=1,
+                                    direction=0, role='', geom=g.line('345')),
+                         rt.BaseWay(osm_id=3, tags=TagStore(), length=5, start=2,
+                                    direction=0, role='approach', geom=g.line('67'))])
+
+    assert route.appendices
+    assert load_route(dump_route(route)) == route
+
+
+@pytest.mark.parametrize('data', [b'', b'WMTX\x01' + bytes(40)])
+def test_load_bad_data(data):
+    with pytest.raises((ValueError, struct.error)):
+        load_route(data)
+
+
+def _make_subroute(g, osm_id, points):
+    route = build_route([rt.BaseWay(osm_id=osm_id, tags=TagStore(), length=5, start=0,
+                                    direction=0, role='', geom=g.line(points))])
+    route.id = osm_id
+    return route
+
+
+def test_lazy_route_header(grid):
+    g = grid('1 2 3 4')
+    route = _make_subroute(g, 3, '1234')
+
+    lazy = load_route(dump_route(route), lazy=True)
+
+    assert not lazy.is_decoded
+    assert lazy.first == route.first
+    assert lazy.last == route.last
+    assert lazy.length == route.length
+    assert lazy.id == 3
+    assert lazy.get_linear_state() == 'yes'
+    assert not lazy.is_decoded
+
+    assert lazy == route
+    assert lazy.is_decoded
+
+
+@pytest.mark.parametrize('ops', [(), ('reverse', ), ('adjust', ), ('reverse', 'adjust'),
+                                 ('adjust', 'reverse'), ('reverse', 'reverse', 'adjust'),
+                                 ('adjust', 'adjust', 'reverse', 'adjust')])
+def test_lazy_route_operations(grid, ops):
+    g = grid('1 2 3 4 5 6')
+    route = build_route([_make_subroute(g, 1, '123'), _make_subroute(g, 2, '456')])
+    route.id = 10
+    route.role = ''
+    route.start = 4
+
+    lazy = load_route(dump_route(route), lazy=True)
+    lazy.start = 4
+
+    for i, op in enumerate(ops):
+        if op == 'reverse':
+            route.reverse()
+            lazy.reverse()
+        else:
+            assert lazy.adjust_start_point(10 * i) == route.adjust_start_point(10 * i)
+        assert lazy.first == route.first
+        assert lazy.last == route.last
+
+    assert lazy == route
+    assert route == lazy
+
+
+def test_build_route_with_lazy_children(grid):
+    g = grid('1 2 3 4 5 6')
+
+    def _members(lazy):
+        out = []
+        for i, sub in enumerate((_make_subroute(g, 1, '321'), _make_subroute(g, 2, '345'),
+                                 _make_subroute(g, 3, '56'))):
+            if lazy:
+                sub = load_route(dump_route(sub), lazy=True)
+            sub.role = ''
+            sub.start = i
+            out.append(sub)
+        return out
+
+    assert build_route(_members(True)) == build_route(_members(False))
+
+
+def test_lazy_route_clone(grid):
+    g = grid('1 2 3 4')
+    route = _make_subroute(g, 3, '1234')
+
+    lazy = load_route(dump_route(route), lazy=True)
+    clone = lazy.clone()
+    clone.reverse()
+
+    assert not lazy.is_decoded
+    assert lazy == route
+    route.reverse()
+    assert clone == route
+
+
+def _make_split_end_route(g):
+    # Forward and backward branch of the final split end in different points.
+    route = build_route([rt.BaseWay(osm_id=i, tags=TagStore(), length=5, start=0,
+                                    direction=d, role='', geom=g.line(pts))
+                         for i, (pts, d) in enumerate((('82', 0), ('234', 1), ('412', 1),
+                                                       ('45', 1), ('64', 1)))])
+    route.id = 20
+    return route
+
+
+def test_lazy_route_reverse_split_end(grid):
+    g = grid("""\
+               1   5
+           8 2   4
+               3   6
+        """)
+    route = _make_split_end_route(g)
+    assert isinstance(route.main[-1], rt.SplitSegment)
+
+    lazy = load_route(dump_route(route), lazy=True)
+    lazy.reverse()
+    route.reverse()
+
+    assert lazy.first == route.first
+    assert lazy.last == route.last
+    assert not lazy.is_decoded
+    assert lazy == route
+
+
+def test_build_route_with_reversed_lazy_split_child(grid):
+    g = grid("""\
+             9 1   5
+           8 2   4
+               3   6
+        """)
+
+    def _members(lazy):
+        sub = _make_split_end_route(g)
+        if lazy:
+            sub = load_route(dump_route(sub), lazy=True)
+        sub.role = ''
+        sub.start = 0
+        # The child route needs to be reversed to connect to the way.
+        return [sub, rt.BaseWay(osm_id=30, tags=TagStore(), length=5, start=1,
+                                direction=0, role='', geom=g.line('89'))]
+
+    assert build_route(_members(True)) == build_route(_members(False))
+
+
+def test_lazy_route_reverse_version1(grid):
+    g = grid("""\
+               1   5
+           8 2   4
+               3   6
+        """)
+    route = _make_split_end_route(g)
+    data = dump_route(route)
+    # Version 1 has no end points for the reversed route.
+    data = b'WMTR\x01' + data[5:37] + data[69:]
+
+    lazy = load_route(data, lazy=True)
+    assert lazy.first == route.first
+    assert lazy.last == route.last
+
+    lazy.reverse()
+    route.reverse()
+
+    assert lazy.first == route.first
+    assert lazy.last == route.last
+    assert lazy == route
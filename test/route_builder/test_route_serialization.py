@@ -5,6 +5,9 @@
 import pytest
 import json
 
+import numpy as np
+import shapely
+
 import wmt_db.geometry.route_types as rt
 from osgende.common.tags import TagStore
 
@@ -104,3 +107,71 @@ def test_dumping(grid, name, obj_builder):
     print(obj.to_json())
 
     assert obj == json.loads(obj.to_json(), object_hook=rt.json_decoder_hook)
+
+
+@pytest.mark.parametrize('name,obj_builder', EXAMPLES)
+def test_clone(grid, name, obj_builder):
+    g = grid("""\
+              7 8
+      1  2  3    4  5  6
+               9
+    """)
+
+    obj = obj_builder(g)
+    orig_json = obj.to_json()
+    clone = obj.clone()
+
+    assert clone == obj
+    assert clone is not obj
+
+    if hasattr(clone, 'reverse'):
+        clone.reverse()
+    clone.adjust_start_point(100)
+
+    assert obj.to_json() == orig_json
+
+
+def test_baseway_from_coordinates(grid):
+    g = grid("1 2 3")
+
+    way = rt.BaseWay(osm_id=1, tags=TagStore(), length=10, direction=1,
+                     coords=np.array(g.coords('123')))
+
+    assert way.first == tuple(g.coord(1))
+    assert way.last == tuple(g.coord(3))
+    assert not way.is_closed
+    assert way == rt.BaseWay(1, TagStore(), 10, 1, g.line('123'))
+
+    way.reverse()
+
+    assert way.direction == -1
+    assert way.first == tuple(g.coord(3))
+    assert way.geom == g.line('321')
+
+
+def test_baseway_reverse_geometries(grid):
+    g = grid("1 2 3")
+    line = g.line('123')
+    way = rt.BaseWay(1, TagStore(), 10, 0, line)
+
+    assert way.geom is line
+    way.reverse()
+
+    assert way.geom == g.line('321')
+    assert way.to_json() == rt.BaseWay(1, TagStore(), 10, 0, g.line('321')).to_json()
+
+    way.reverse()
+    assert way.geom == line
+    way.reverse()
+    assert way.geom == g.line('321')
+
+
+def test_baseway_coords_setter(grid):
+    g = grid("1 2 3")
+    way = rt.BaseWay(1, TagStore(), 10, 1, g.line('123'))
+    way.reverse()
+
+    way.coords = shapely.get_coordinates(g.line('12'))
+
+    assert way.geom == g.line('12')
+    assert way.endpoints == (tuple(g.coord('1')), tuple(g.coord('2')))
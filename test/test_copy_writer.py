@@ -0,0 +1,71 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This file is part of the Waymarked Trails Map Project
+# Copyright (C) 2024 Sarah Hoffmann
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
+from geoalchemy2 import Geometry
+from geoalchemy2.shape import from_shape, to_shape
+from shapely.geometry import LineString
+
+from osgende.common.table import TableSource
+
+from wmt_db.common.copy_writer import CopyWriter
+
+
+@pytest.fixture
+def copy_table(mapdb):
+    table = mapdb.add_table('copy_test',
+                TableSource(sa.Table('copy_test', mapdb.metadata,
+                                     sa.Column('id', sa.BigInteger, primary_key=True),
+                                     sa.Column('name', sa.String),
+                                     sa.Column('tags', JSONB),
+                                     sa.Column('members', ARRAY(sa.BigInteger)),
+                                     sa.Column('top', sa.Boolean),
+                                     sa.Column('data', sa.LargeBinary),
+                                     sa.Column('geom', Geometry('LINESTRING', 4326)))))
+    mapdb.create()
+
+    return table
+
+
+def test_copy_rows(mapdb, copy_table):
+    line = LineString([(0, 0), (1, 1)])
+    writer = CopyWriter(copy_table.data, mapdb.engine.dialect)
+    lines = [writer.encode(dict(id=1, name='A\tb\\c\nd', tags={'name': 'x"y'},
+                                members=[3, 4], top=True, data=b'\x00\x01\\',
+                                geom=from_shape(line, srid=4326)))]
+    lines.extend(writer.encode(dict(id=i, top=False)) for i in range(2, 10))
+
+    with mapdb.engine.begin() as conn:
+        writer.copy(conn, lines[:4])
+        writer.copy(conn, lines[4:])
+
+    with mapdb.engine.begin() as conn:
+        rows = {r.id: r for r in conn.execute(copy_table.data.select())}
+
+    assert len(rows) == 9
+    assert rows[1].name == 'A\tb\\c\nd'
+    assert rows[1].tags == {'name': 'x"y'}
+    assert rows[1].members == [3, 4]
+    assert rows[1].top
+    assert bytes(rows[1].data) == b'\x00\x01\\'
+    assert to_shape(rows[1].geom).equals(line)
+
+    assert rows[5].name is None
+    assert rows[5].geom is None
+    assert not rows[5].top
+
+
+def test_copy_rolled_back(mapdb, copy_table):
+    writer = CopyWriter(copy_table.data, mapdb.engine.dialect)
+
+    with pytest.raises(ValueError):
+        with mapdb.engine.begin() as conn:
+            writer.copy(conn, [writer.encode(dict(id=1))])
+            raise ValueError()
+
+    with mapdb.engine.begin() as conn:
+        assert conn.scalar(sa.select(sa.func.count()).select_from(copy_table.data)) == 0
@@ -0,0 +1,72 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This file is part of the Waymarked Trails Map Project
+# Copyright (C) 2024 Sarah Hoffmann
+
+import pytest
+import sqlalchemy as sa
+
+from wmt_db.common.route_cache import RouteCache
+
+
+@pytest.fixture
+def routes():
+    engine = sa.create_engine('sqlite://')
+    table = sa.Table('routes', sa.MetaData(),
+                     sa.Column('id', sa.BigInteger, primary_key=True),
+                     sa.Column('name', sa.String))
+    table.create(engine)
+    with engine.begin() as conn:
+        conn.execute(table.insert().values([dict(id=1, name='A'), dict(id=2, name='B')]))
+
+    queries = []
+    sa.event.listen(engine, 'before_cursor_execute',
+                    lambda *args: queries.append(args[2]))
+
+    with engine.connect() as conn:
+        yield table, conn, queries
+
+
+def test_get_loads_once(routes):
+    table, conn, queries = routes
+    cache = RouteCache(table, ['name'])
+
+    assert cache.get(conn, 1).name == 'A'
+    assert cache.get(conn, 1).name == 'A'
+
+    assert len(queries) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_missing_route_is_cached(routes):
+    table, conn, queries = routes
+    cache = RouteCache(table, ['name'])
+
+    assert cache.get(conn, 10) is None
+    assert cache.get(conn, 10) is None
+
+    assert len(queries) == 1
+    assert 10 in cache
+
+
+def test_load_remembers_missing_routes(routes):
+    table, conn, queries = routes
+    cache = RouteCache(table, ['name'])
+
+    assert set(cache.load(conn, [1, 10])) == {1}
+    assert cache.missing([1, 2, 10]) == [2]
+    assert cache.get(conn, 10) is None
+
+    assert len(queries) == 1
+
+
+def test_missing_route_is_evicted(routes):
+    table, conn, queries = routes
+    cache = RouteCache(table, ['name'], max_size=1)
+
+    assert cache.get(conn, 10) is None
+    assert cache.get(conn, 2).name == 'B'
+    assert 10 not in cache
+    assert cache.get(conn, 10) is None
+
+    assert len(queries) == 3
@@ -3,8 +3,12 @@
 # This file is part of the Waymarked Trails Map Project
 # Copyright (C) 2020 Sarah Hoffmann
 from dataclasses import dataclass
+from types import MethodType
 
 import pytest
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import ARRAY
 
 from wmt_db.styles.route_network_style import RouteNetworkStyle
 
@@ -59,3 +63,54 @@ def test_shields(style, collector):
     assert cols['toprels'] == [1, 2, 9]
     assert cols['lshields'] == ['X']
     assert cols['inrshields'] == ['Y']
+
+@pytest.fixture
+def sql_tables():
+    meta = sa.MetaData()
+    routes = sa.Table('routes', meta,
+                      *(sa.Column(c, sa.String) for c in ('network', 'symbol', 'country')),
+                      sa.Column('id', sa.BigInteger),
+                      sa.Column('top', sa.Boolean),
+                      sa.Column('level', sa.Integer))
+    ways = sa.Table('ways', meta,
+                    sa.Column('id', sa.BigInteger),
+                    sa.Column('rels', ARRAY(sa.BigInteger)))
+
+    return sa.select(ways.c.id, ways.c.rels).subquery(), routes
+
+def _sql_text(sql):
+    return str(sql.compile(dialect=postgresql.dialect()))
+
+def test_construct_sql(style, sql_tables):
+    sql = style.construct_sql(*sql_tables)
+
+    assert sql is not None
+    assert 'HAVING' not in _sql_text(sql)
+
+def test_construct_sql_replaced_hook(style, sql_tables):
+    style.add_to_collector = MethodType(lambda self, c, relinfo: None, style)
+
+    assert style.construct_sql(*sql_tables) is None
+
+def test_construct_sql_custom_routes(style, sql_tables):
+    style.add_to_collector = MethodType(lambda self, c, relinfo: None, style)
+    style.custom_routes = lambda r: r.c.network == 'CU'
+
+    sql = style.construct_sql(*sql_tables)
+
+    assert sql is not None
+    assert 'HAVING NOT coalesce(bool_or(routes.network = ' in _sql_text(sql)
+
+@pytest.mark.parametrize('order', [(0, 1, 2, 3, 4, 5, 6), (6, 5, 4, 3, 2, 1, 0),
+                                   (3, 6, 0, 5, 1, 4, 2)])
+def test_shields_truncated(style, collector, order):
+    for i in order:
+        style.add_to_collector(collector,
+            RelInfo(id=i, top=True, level=1, symbol=f'S{i}', network=None))
+        style.add_to_collector(collector,
+            RelInfo(id=10 + i, top=True, level=20, symbol=f'T{i}', network=None))
+
+    cols = style.to_columns(collector)
+
+    assert cols['lshields'] == ['S0', 'S1', 'S2', 'S3', 'S4']
+    assert cols['inrshields'] == ['T0', 'T1', 'T2', 'T3', 'T4']
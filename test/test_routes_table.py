@@ -39,8 +39,13 @@ class TestRoutesTable:
         tag_filter = None
 
 
+    @pytest.fixture
+    def table_options(self):
+        return {}
+
     @pytest.fixture(autouse=True)
-    def init_tables(self, mapdb, segment_table, countries, shields):
+    def init_tables(self, mapdb, segment_table, countries, shields, table_options):
+        mapdb.metadata.info.update(table_options)
         rels = mapdb.add_table('src_rels',
                    OsmSourceTables.create_relation_table(mapdb.metadata))
         hier = mapdb.add_table('hierarchy',
@@ -86,6 +91,24 @@ class TestRoutesTable:
              dict(id=4, level=Network.NAT())
             ])
 
+    def test_country(self, mapdb, tags):
+        mapdb.insert_into('ways')\
+           .line(1, rels=[1], nodes=[1,2], geom='SRID=4326;LINESTRING(0.5 0.5, 0.6 0.6)')\
+           .line(2, rels=[2], nodes=[3,4], geom='SRID=4326;LINESTRING(-0.5 0.5, -0.6 0.6)')\
+           .line(3, rels=[3], nodes=[5,6], geom='SRID=4326;LINESTRING(5 5, 5.1 5.1)')
+        mapdb.insert_into('src_rels')\
+            .line(1, tags=tags(), members=[dict(id=1, role='', type='W')])\
+            .line(2, tags=tags(), members=[dict(id=2, role='', type='W')])\
+            .line(3, tags=tags(), members=[dict(id=3, role='', type='W')])
+
+        mapdb.construct()
+
+        mapdb.table_equals('test',
+            [dict(id=1, country='de'),
+             dict(id=2, country='fr'),
+             dict(id=3, country=None)
+            ])
+
     def test_itinerary(self, mapdb, tags, members):
         mapdb.insert_into('src_rels')\
             .line(100, tags=tags(), members=members)\
@@ -328,3 +351,30 @@ class TestRoutesTable:
             dict(id=1, name='other', rel_members=None,
                  geom=expected_geometry),
             ])
+
+
+class TestRoutesTableBatched(TestRoutesTable):
+    """ Rerun all tests with relations processed in batches.
+    """
+
+    @pytest.fixture
+    def table_options(self):
+        return {'batch_size': 3}
+
+
+class TestRoutesTableProcessPool(TestRoutesTable):
+    """ Rerun all tests with routes assembled in worker processes.
+    """
+
+    @pytest.fixture
+    def table_options(self):
+        return {'num_processes': 2}
+
+
+class TestRoutesTableCountryIndex(TestRoutesTable):
+    """ Rerun all tests with the in-memory country lookup.
+    """
+
+    @pytest.fixture
+    def table_options(self):
+        return {'country_index': True}
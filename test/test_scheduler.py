@@ -0,0 +1,114 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This file is part of the Waymarked Trails Map Project
+# Copyright (C) 2024 Sarah Hoffmann
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import logging
+
+import pytest
+
+from wmt_db.common.scheduler import HierarchyScheduler
+
+Rel = namedtuple('Rel', 'id')
+
+
+class Runner:
+    """ Runs the tasks of a scheduler and records the order.
+    """
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.tasks = []
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        scheduler.start(self.submit)
+
+    def submit(self, objs):
+        self.tasks.append([o.id for o in objs])
+        return self.executor.submit(lambda: None)
+
+    def run(self, *ids):
+        for oid in ids:
+            self.scheduler.add(Rel(oid))
+        self.scheduler.finish()
+        self.executor.shutdown()
+
+        return self.tasks
+
+    @property
+    def done(self):
+        return [oid for task in self.tasks for oid in task]
+
+
+@pytest.fixture
+def scheduler():
+    return HierarchyScheduler(batch_size=1, max_pending=4)
+
+
+def test_children_before_parents(scheduler):
+    scheduler.add_dependency(1, 2)
+    scheduler.add_dependency(1, 3)
+    scheduler.add_dependency(3, 4)
+
+    runner = Runner(scheduler)
+    runner.run(1, 3, 2, 4)
+
+    done = runner.done
+    assert sorted(done) == [1, 2, 3, 4]
+    assert done.index(4) < done.index(3) < done.index(1)
+    assert done.index(2) < done.index(1)
+
+
+def test_batches():
+    scheduler = HierarchyScheduler(batch_size=3, max_pending=1)
+    runner = Runner(scheduler)
+
+    tasks = runner.run(1, 2, 3, 4, 5, 6, 7)
+
+    assert tasks == [[1, 2, 3], [4, 5, 6], [7]]
+
+
+def test_parent_released_in_batch():
+    scheduler = HierarchyScheduler(batch_size=2, max_pending=1)
+    scheduler.add_dependency(1, 2)
+    runner = Runner(scheduler)
+
+    tasks = runner.run(1, 2, 3)
+
+    assert tasks == [[2, 3], [1]]
+
+
+def test_cycle_processes_all(scheduler, caplog):
+    scheduler.add_dependency(1, 2)
+    scheduler.add_dependency(2, 1)
+    scheduler.add_dependency(3, 1)
+    runner = Runner(scheduler)
+
+    with caplog.at_level(logging.WARNING):
+        runner.run(1, 2, 3, 4)
+
+    assert sorted(runner.done) == [1, 2, 3, 4]
+    assert 'Cycle detected' in caplog.text
+
+
+def test_unknown_child_is_no_cycle(scheduler, caplog):
+    scheduler.add_dependency(1, 2)
+    scheduler.add_dependency(1, 3)
+    runner = Runner(scheduler)
+
+    with caplog.at_level(logging.WARNING):
+        runner.run(1, 3)
+
+    assert runner.done == [3, 1]
+    assert 'Cycle detected' not in caplog.text
+
+
+def test_statistics(scheduler):
+    scheduler.add_dependency(1, 2)
+    scheduler.set_level(2, 2)
+    runner = Runner(scheduler)
+
+    runner.run(1, 2)
+
+    assert {lvl: s[0] for lvl, s in scheduler.stats.items()} == {1: 1, 2: 1}
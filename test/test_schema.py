@@ -0,0 +1,37 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This file is part of the Waymarked Trails Map Project
+# Copyright (C) 2024 Sarah Hoffmann
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from osgende.common.table import TableSource
+
+from wmt_db.common.schema import add_missing_columns
+
+
+def test_add_missing_columns(mapdb):
+    table = mapdb.add_table('schema_test',
+                TableSource(sa.Table('schema_test', mapdb.metadata,
+                                     sa.Column('id', sa.BigInteger, primary_key=True),
+                                     sa.Column('hash', sa.BigInteger),
+                                     sa.Column('points', ARRAY(sa.Float)))))
+    mapdb.create()
+
+    with mapdb.engine.begin() as conn:
+        conn.execute(table.data.insert().values(id=1, hash=3))
+        conn.execute(sa.text('ALTER TABLE schema_test DROP COLUMN hash'))
+        conn.execute(sa.text('ALTER TABLE schema_test DROP COLUMN points'))
+
+    assert add_missing_columns(mapdb.engine, [table.data]) == 2
+    assert add_missing_columns(mapdb.engine, [table.data]) == 0
+
+    mapdb.table_equals('schema_test', [dict(id=1, hash=None, points=None)])
+
+
+def test_ignore_missing_table(mapdb):
+    table = sa.Table('schema_none', sa.MetaData(),
+                     sa.Column('id', sa.BigInteger))
+
+    assert add_missing_columns(mapdb.engine, [table]) == 0
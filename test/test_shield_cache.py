@@ -0,0 +1,113 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This file is part of the Waymarked Trails Map Project
+# Copyright (C) 2024 Sarah Hoffmann
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+import pytest
+
+from wmt_db.common.shield_cache import ShieldCache
+
+class CountingShield:
+
+    def __init__(self, uid):
+        self.uid = uid
+        self.written = 0
+
+    def uuid(self):
+        return self.uid
+
+    def to_file(self, fname, **kwargs):
+        self.written += 1
+        fname.write_text('<svg/>')
+
+
+class FailingShield(CountingShield):
+
+    def to_file(self, fname, **kwargs):
+        fname.write_text('<sv')
+        raise OSError('disk full')
+
+
+def test_write_once(tmp_path):
+    cache = ShieldCache(tmp_path)
+    sym = CountingShield('abc')
+
+    assert cache.write(sym) == 'abc'
+    assert cache.write(sym) == 'abc'
+
+    assert sym.written == 1
+    assert (tmp_path / 'abc.svg').exists()
+
+
+def test_no_shield(tmp_path):
+    assert ShieldCache(tmp_path).write(None) == 'None'
+
+
+def test_preload(tmp_path):
+    (tmp_path / 'abc.svg').write_text('<svg/>')
+    sym = CountingShield('abc')
+    other = CountingShield('xyz')
+
+    cache = ShieldCache(tmp_path, preload=True)
+
+    assert cache.write(sym) == 'abc'
+    assert cache.write(other) == 'xyz'
+
+    assert sym.written == 0
+    assert other.written == 1
+
+
+def test_preload_after_clear(tmp_path):
+    cache = ShieldCache(tmp_path, preload=True)
+    assert cache.write(CountingShield('abc')) == 'abc'
+
+    cache.clear()
+    (tmp_path / 'xyz.svg').write_text('<svg/>')
+    sym = CountingShield('xyz')
+
+    assert cache.write(sym) == 'xyz'
+    assert sym.written == 0
+
+
+def test_clear(tmp_path):
+    cache = ShieldCache(tmp_path)
+    sym = CountingShield('abc')
+
+    cache.write(sym)
+    cache.clear()
+    cache.write(sym)
+
+    assert sym.written == 2
+
+
+def test_write_concurrently(tmp_path):
+    cache = ShieldCache(tmp_path)
+    sym = CountingShield('abc')
+    barrier = threading.Barrier(8)
+
+    def _write():
+        barrier.wait()
+        return cache.write(sym)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = [executor.submit(_write) for _ in range(8)]
+
+    assert all(r.result() == 'abc' for r in results)
+    assert sym.written == 1
+    assert [f.name for f in tmp_path.iterdir()] == ['abc.svg']
+
+
+def test_failed_write(tmp_path):
+    cache = ShieldCache(tmp_path)
+
+    with pytest.raises(OSError):
+        cache.write(FailingShield('abc'))
+
+    assert not list(tmp_path.iterdir())
+
+    sym = CountingShield('abc')
+    assert cache.write(sym) == 'abc'
+    assert sym.written == 1
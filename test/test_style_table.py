@@ -3,6 +3,8 @@
 # This file is part of the Waymarked Trails Map Project
 # Copyright (C) 2020 Sarah Hoffmann
 
+from types import MethodType
+
 import pytest
 import sqlalchemy as sa
 from sqlalchemy.dialects.postgresql import ARRAY
@@ -12,7 +14,8 @@ from osgende.relations import RelationHierarchy
 from osgende.osmdata import OsmSourceTables
 
 from wmt_db.tables.updates import UpdatedGeometriesTable
-from wmt_db.tables.styles import StyleTable
+from wmt_db.tables.styles import StyleTable, _style_hash
+from wmt_db.styles.route_network_style import RouteNetworkStyle
 
 
 class StyleTestConfig:
@@ -99,6 +102,215 @@ class TestStyleTableCreate:
              dict(id=11, names=['A', 'B'])
             ])
 
+    def test_batched_rows(self, mapdb):
+        mapdb.tables['test'].batch_size = 2
+
+        for i in range(1, 6):
+            mapdb.insert_into('ways')\
+                .line(i, rels=[(i % 3) + 1], geom='SRID=4326;LINESTRING(0 0, 0.1 0.1)')
+
+        mapdb.construct()
+
+        mapdb.table_equals('test',
+            [dict(id=1, names=['B']),
+             dict(id=2, names=['C']),
+             dict(id=3, names=['A']),
+             dict(id=4, names=['B']),
+             dict(id=5, names=['C'])
+            ])
+
+    def test_small_route_cache(self, mapdb):
+        mapdb.tables['test'].route_cache_size = 1
+
+        mapdb.insert_into('ways')\
+            .line(23, rels=[2, 3], geom='SRID=4326;LINESTRING(0 0, 0.1 0.1)')\
+            .line(25, rels=[1, 2, 3], geom='SRID=4326;LINESTRING(1 1, 0.1 0.1)')
+
+        mapdb.construct()
+
+        mapdb.table_equals('test',
+            [dict(id=23, names=['B', 'C']),
+             dict(id=25, names=['A', 'B', 'C'])
+            ])
+
+    def test_preloaded_routes(self, mapdb):
+        mapdb.tables['test'].preload_routes = True
+
+        mapdb.insert_into('ways')\
+            .line(23, rels=[2, 3], geom='SRID=4326;LINESTRING(0 0, 0.1 0.1)')\
+            .line(25, rels=[1, 4], geom='SRID=4326;LINESTRING(1 1, 0.1 0.1)')
+
+        mapdb.construct()
+
+        mapdb.table_equals('test',
+            [dict(id=23, names=['B', 'C']),
+             dict(id=25, names=['A'])
+            ])
+
+
+def _network_style_tables(mapdb, segment_table, style_config):
+    route_table = mapdb.add_table('routes',
+                TableSource(sa.Table('routes', mapdb.metadata,
+                                     sa.Column('id', sa.BigInteger),
+                                     sa.Column('top', sa.Boolean),
+                                     sa.Column('network', sa.String),
+                                     sa.Column('level', sa.SmallInteger),
+                                     sa.Column('symbol', sa.String),
+                                     sa.Column('country', sa.String)),
+                            change_table='route_changeset'))
+    rels = mapdb.add_table('src_rels',
+               OsmSourceTables.create_relation_table(mapdb.metadata))
+    hier = mapdb.add_table('hierarchy',
+               RelationHierarchy(mapdb.metadata, 'hierarchy', rels, track_changes=True))
+    uptable = mapdb.add_table('updates',
+                  UpdatedGeometriesTable(mapdb.metadata, 'updates'))
+
+    return mapdb.add_table('test',
+                    StyleTable(mapdb.metadata, route_table, segment_table,
+                               hier, style_config, uptable))
+
+
+class TestRouteNetworkStyleCreate:
+
+    @pytest.fixture(autouse=True, params=[False, True])
+    def init_tables(self, request, mapdb, segment_table):
+        style = _network_style_tables(mapdb, segment_table, RouteNetworkStyle())
+        style.use_sql_style = request.param
+        mapdb.create()
+
+        mapdb.insert_into('routes')\
+            .line(1, top=True, network=None, level=3, symbol='L1')\
+            .line(2, top=True, network='NDS', level=10, symbol='N2')\
+            .line(3, top=True, network='AB', level=24, symbol='I3')\
+            .line(4, top=False, network=None, level=3, symbol='L4')\
+            .line(5, top=True, network='XY', level=10, symbol=None)
+
+    def test_style_columns(self, mapdb):
+        mapdb.insert_into('ways')\
+            .line(10, rels=[1, 4, 3], geom='SRID=4326;LINESTRING(0 0, 0.1 0.1)')\
+            .line(11, rels=[3, 2, 99], geom='SRID=4326;LINESTRING(0 0, 0.1 0.1)')\
+            .line(12, rels=[4], geom='SRID=4326;LINESTRING(0 0, 0.1 0.1)')\
+            .line(13, rels=[99], geom='SRID=4326;LINESTRING(0 0, 0.1 0.1)')\
+            .line(14, rels=[5], geom='SRID=4326;LINESTRING(0 0, 0.1 0.1)')
+
+        mapdb.construct()
+
+        mapdb.table_equals('test',
+            [{'id': 10, 'class': (1 << 3) | (1 << 24), 'style': 'AB',
+              'lshields': ['L1'], 'inrshields': ['I3'],
+              'toprels': [1, 3], 'cldrels': [4]},
+             {'id': 11, 'class': 1 << 24, 'style': 'NDS',
+              'lshields': None, 'inrshields': ['I3'],
+              'toprels': [3, 2], 'cldrels': []},
+             {'id': 12, 'class': 0, 'style': None,
+              'lshields': None, 'inrshields': None,
+              'toprels': [], 'cldrels': [4]},
+             {'id': 13, 'class': 0, 'style': None,
+              'lshields': None, 'inrshields': None,
+              'toprels': [], 'cldrels': []},
+             {'id': 14, 'class': 1 << 10, 'style': 'XY',
+              'lshields': None, 'inrshields': None,
+              'toprels': [5], 'cldrels': []}
+            ])
+
+
+def _custom_add_to_collector(self, c, relinfo):
+    # Routes of network 'CU' get no class and no shields.
+    if relinfo.top and relinfo.network == 'CU':
+        c['toprels'].append(relinfo.id)
+        c['style'] = relinfo.network
+    else:
+        RouteNetworkStyle.add_to_collector(self, c, relinfo)
+
+
+class TestCustomNetworkStyleCreate:
+
+    @pytest.fixture(autouse=True, params=[(False, False), (True, False), (True, True)])
+    def init_tables(self, request, mapdb, segment_table):
+        config = RouteNetworkStyle()
+        config.add_to_collector = MethodType(_custom_add_to_collector, config)
+        if request.param[1]:
+            config.custom_routes = lambda r: r.c.network == 'CU'
+        style = _network_style_tables(mapdb, segment_table, config)
+        style.use_sql_style = request.param[0]
+        mapdb.create()
+
+        mapdb.insert_into('routes')\
+            .line(1, top=True, network=None, level=3, symbol='L1')\
+            .line(2, top=True, network='CU', level=24, symbol='C2')\
+            .line(3, top=True, network='AB', level=24, symbol='I3')
+
+        mapdb.insert_into('ways')\
+            .line(10, rels=[1, 3], geom='SRID=4326;LINESTRING(0 0, 0.1 0.1)')\
+            .line(11, rels=[1, 2], geom='SRID=4326;LINESTRING(0 0, 0.1 0.1)')
+
+        mapdb.construct()
+
+    def test_style_columns(self, mapdb):
+        mapdb.table_equals('test',
+            [{'id': 10, 'class': (1 << 3) | (1 << 24), 'style': 'AB',
+              'lshields': ['L1'], 'inrshields': ['I3'],
+              'toprels': [1, 3], 'cldrels': []},
+             {'id': 11, 'class': 1 << 3, 'style': 'CU',
+              'lshields': ['L1'], 'inrshields': None,
+              'toprels': [1, 2], 'cldrels': []}
+            ])
+
+    def test_style_hash_after_update(self, mapdb):
+        mapdb.modify('routes').modify(3, top=True, network='AB', level=24, symbol='I3')
+
+        mapdb.update()
+
+        with mapdb.engine.begin() as conn:
+            t = mapdb.tables['test'].data
+            assert conn.scalar(sa.select(sa.func.count())
+                                 .where(t.c.id == 10)
+                                 .where(t.c.style_hash == None)) == 0
+
+
+class TestNetworkStyleShields:
+
+    @pytest.fixture(autouse=True, params=[False, True])
+    def init_tables(self, request, mapdb, segment_table):
+        self.config = RouteNetworkStyle()
+        style = _network_style_tables(mapdb, segment_table, self.config)
+        style.use_sql_style = request.param
+        mapdb.create()
+
+        routes = mapdb.insert_into('routes')
+        for i in range(7):
+            routes.line(i, top=True, network=None, level=3, symbol=f'L{6 - i}')
+            routes.line(10 + i, top=True, network=None, level=20, symbol=f'i{i}')
+            routes.line(20 + i, top=True, network=None, level=20, symbol=f'I{i}')
+
+        mapdb.insert_into('ways')\
+            .line(10, rels=list(range(27)), geom='SRID=4326;LINESTRING(0 0, 0.1 0.1)')
+
+        mapdb.construct()
+
+    def test_many_shields(self, mapdb):
+        table = mapdb.tables['test']
+        columns = [c for c in table.data.columns
+                   if c.name not in ('id', 'geom', 'geom100', 'style_hash')]
+
+        with mapdb.engine.begin() as conn:
+            row = conn.execute(sa.select(*columns, table.c.style_hash)).one()
+            routes = conn.execute(sa.select(mapdb.tables['routes'].data)
+                                    .order_by(sa.text('id'))).all()
+
+        # Compute the columns in Python independently of the table.
+        collector = self.config.new_collector()
+        for route in routes:
+            self.config.add_to_collector(collector, route)
+        expected = self.config.to_columns(collector)
+
+        built = {c.name: row._mapping[c.name] for c in columns}
+        assert built['lshields'] == ['L0', 'L1', 'L2', 'L3', 'L4']
+        assert built['inrshields'] == ['I0', 'I1', 'I2', 'I3', 'I4']
+        assert built == expected
+        assert _style_hash(built) == _style_hash(expected)
+        assert row.style_hash in (None, _style_hash(expected))
+
 
 class TestStyleTableUpdate:
 
@@ -157,6 +369,21 @@ class TestStyleTableUpdate:
             [dict(id=12, names=['A', 'B', 'X']),
              dict(id=20, names=['X'])])
 
+        mapdb.table_equals('updates',
+            [dict(geom='LINESTRING(0 0, 0.1 0.1)'),
+             dict(geom='LINESTRING(0 0, 0.1 0.1)')])
+
+    def test_unchanged_relation_style(self, mapdb):
+        mapdb.modify('routes').modify(3, name='C')
+
+        mapdb.update()
+
+        mapdb.table_equals('test',
+            [dict(id=12, names=['A', 'B', 'C']),
+             dict(id=20, names=['C'])])
+
+        mapdb.table_equals('updates', [])
+
 
 class TestStyleTableHierarchyUpdates:
 
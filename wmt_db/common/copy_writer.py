@@ -0,0 +1,111 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This file is part of the Waymarked Trails Map Project
+# Copyright (C) 2024 Sarah Hoffmann
+""" Bulk loading of table rows with COPY FROM STDIN.
+"""
+import io
+import json
+
+import sqlalchemy as sa
+from geoalchemy2 import Geometry
+from geoalchemy2.elements import WKBElement
+
+_TEXT_ESCAPES = str.maketrans({'\\': '\\\\', '\n': '\\n', '\r': '\\r', '\t': '\\t'})
+
+
+def _text(value):
+    return str(value).translate(_TEXT_ESCAPES)
+
+
+def _json(value):
+    return json.dumps(value).translate(_TEXT_ESCAPES)
+
+
+def _bool(value):
+    return 't' if value else 'f'
+
+
+def _bytea(value):
+    return '\\\\x' + bytes(value).hex()
+
+
+def _geometry(value):
+    if isinstance(value, WKBElement) and not value.extended:
+        value = value.as_ewkb()
+    return _text(value.desc if isinstance(value, WKBElement) else value)
+
+
+def _array_element(value):
+    if value is None:
+        return 'NULL'
+    if isinstance(value, (int, float)):
+        return str(value)
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def _array(value):
+    return _text('{' + ','.join(_array_element(v) for v in value) + '}')
+
+
+def _make_encoder(coltype):
+    if isinstance(coltype, sa.JSON):
+        return _json
+    if isinstance(coltype, sa.ARRAY):
+        return _array
+    if isinstance(coltype, Geometry):
+        return _geometry
+    if isinstance(coltype, sa.LargeBinary):
+        return _bytea
+    if isinstance(coltype, sa.Boolean):
+        return _bool
+    return _text
+
+
+class CopyWriter:
+    """ Writes rows into a table with COPY in text format.
+
+        Rows are handed in as dictionaries with the column names as keys,
+        missing columns are written as NULL. encode() turns a row into
+        a line of COPY data, copy() sends a list of such lines over the
+        given connection. The writer does not hold any connections
+        itself, so that lines may be collected in any thread and written
+        with the connection that is at hand.
+
+        No conflict handling takes place, use the writer only to fill
+        empty tables.
+    """
+
+    def __init__(self, table, dialect):
+        self.columns = [(c.name, _make_encoder(c.type)) for c in table.columns]
+
+        prep = dialect.identifier_preparer
+        self.sql = 'COPY {} ({}) FROM STDIN'.format(
+                       prep.format_table(table),
+                       ', '.join(prep.quote(c.name) for c in table.columns))
+
+    def encode(self, row):
+        """ Return the line for the given row in COPY text format.
+        """
+        return '\t'.join('\\N' if (value := row.get(name)) is None else encode(value)
+                         for name, encode in self.columns) + '\n'
+
+    def copy(self, conn, lines):
+        """ Write the given lines within the transaction of the
+            SQLAlchemy connection 'conn'.
+        """
+        if not lines:
+            return
+
+        data = ''.join(lines)
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            if hasattr(cursor, 'copy_expert'):
+                # psycopg2
+                cursor.copy_expert(self.sql, io.StringIO(data))
+            else:
+                # psycopg 3
+                with cursor.copy(self.sql) as copy:
+                    copy.write(data)
+        finally:
+            cursor.close()
@@ -6,9 +6,6 @@
 """
 
 from shapely.ops import linemerge
-from geoalchemy2.shape import from_shape
-
-from osgende.common.build_geometry import build_route_geometry
 
 def make_itinerary(tags):
     """ Create an itinerary from 'to', 'from' and 'via' tags.
@@ -34,16 +31,13 @@ def make_itinerary(tags):
 
     return ret if ret else None
 
-def make_geometry(conn, members, ways, table):
-    """ Create the geometry for a route relation.
+def fix_route_geometry(geom):
+    """ Clean up the raw geometry of a route relation. Returns the fixed
+        geometry and the simplified geometry to use for rendering as
+        Shapely objects.
     """
-    geom = build_route_geometry(conn, members, ways, table)
-
-    if geom is None:
-        return None, None
-
     if geom.geom_type not in ('MultiLineString', 'LineString'):
-        raise RuntimeError("Bad geometry %s for %d" % (geom.geom_type, obj['id']))
+        raise RuntimeError("Bad geometry %s for route" % geom.geom_type)
 
     # if the route is unsorted but linear, sort it
     if geom.geom_type == 'MultiLineString':
@@ -54,8 +48,4 @@ def make_geometry(conn, members, ways, table):
     else:
         render_geom = geom
 
-    render_geom = render_geom.simplify(1)
-
-    srid = table.c.geom.type.srid
-
-    return from_shape(geom, srid=srid), from_shape(render_geom, srid=srid)
+    return geom, render_geom.simplify(1)
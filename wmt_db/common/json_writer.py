@@ -99,6 +99,14 @@ class JsonWriter:
         """
         return self.raw(f"{value:0.{precision}f}")
 
+    def coordinates(self, values: list[float], precision: int) -> 'JsonWriter':
+        """ Write out an array of coordinate pairs. 'values' must be
+            the flat list of x and y values. The floats are written with
+            the given precision.
+        """
+        fmt = f"[%.{precision}f,%.{precision}f]"
+        return self.raw(f"[{','.join([fmt] * (len(values) // 2)) % tuple(values)}]")
+
     def next(self) -> 'JsonWriter':
         """ Write out a delimiter comma between JSON object or array elements.
         """
@@ -139,11 +147,15 @@ class JsonWriter:
         return self
 
     def object_array(self, values: list[object]) -> 'JsonWriter':
-        """ Write out an array of objects that have a to_json() function
-            to produce raw json.
+        """ Write out an array of objects. The objects either need to
+            have a write_json() function, which writes the object into
+            the given writer, or a to_json() function to produce raw json.
         """
         self.start_array()
         for v in values:
-            self.raw(v.to_json()).next()
+            if hasattr(v, 'write_json'):
+                v.write_json(self).next()
+            else:
+                self.raw(v.to_json()).next()
         self.end_array()
         return self
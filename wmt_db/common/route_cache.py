@@ -0,0 +1,185 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This file is part of the Waymarked Trails Map Project
+# Copyright (C) 2024 Sarah Hoffmann
+""" Cache for route information needed by the style tables.
+"""
+from array import array
+from bisect import bisect_left
+from collections import namedtuple, OrderedDict
+import logging
+import threading
+
+import sqlalchemy as sa
+
+LOG = logging.getLogger(__name__)
+
+# Marker for entries that are not in the cache. Routes that do not exist
+# are cached with None.
+_ABSENT = object()
+
+def _select_columns(table, columns):
+    if columns is None:
+        return [c for c in table.c if c.name != 'geom']
+
+    return [table.c.id] + [table.c[c] for c in columns if c != 'id']
+
+
+class RouteCache:
+    """ Bounded cache of route information with least-recently-used eviction.
+
+        Only the given columns of the route table are kept. Each route
+        is saved as a named tuple with the column names as field names.
+        The column 'id' is always included.
+
+        The cache is meant to be filled in bulk with load() before the
+        information is needed. get() loads missing routes from the
+        database, so that it is still correct when a route has been
+        evicted in the meantime. Routes that do not exist in the database
+        are remembered as well and evicted like any other entry.
+        All functions may be used concurrently.
+    """
+
+    def __init__(self, table, columns=None, max_size=100000):
+        cols = _select_columns(table, columns)
+
+        self.id_column = table.c.id
+        self.sql = sa.select(*cols)
+        self.info_type = namedtuple('RouteInfo', [c.name for c in cols], rename=True)
+        self.max_size = max_size
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, oid):
+        return oid in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def missing(self, ids):
+        """ Return the ids from the given list that are not in the cache.
+        """
+        return [oid for oid in ids if oid not in self.data]
+
+    def load(self, conn, ids):
+        """ Load the routes with the given ids into the cache.
+            Returns a dictionary of the loaded route information.
+        """
+        result = {}
+        for row in conn.execute(self.sql.where(self.id_column.in_(ids))):
+            result[row.id] = self.info_type._make(row)
+
+        with self.lock:
+            for oid in ids:
+                self.data[oid] = result.get(oid)
+                self.data.move_to_end(oid)
+            while len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+
+        return result
+
+    def get(self, conn, oid):
+        """ Get the information for the route with the given id.
+            Returns None when the route does not exist.
+        """
+        with self.lock:
+            info = self.data.get(oid, _ABSENT)
+            if info is not _ABSENT:
+                self.hits += 1
+                self.data.move_to_end(oid)
+                return info
+            self.misses += 1
+
+        return self.load(conn, [oid]).get(oid)
+
+    def log_statistics(self):
+        LOG.info("Route cache: %d hits, %d misses, %d routes cached.",
+                 self.hits, self.misses, len(self.data))
+
+
+class PreloadedRouteCache:
+    """ Read-only map with the information of all routes.
+
+        The map is filled once with preload(). Route ids are kept in a
+        sorted array and looked up with a binary search. The column values
+        are saved in lists parallel to the id array, equal strings
+        are shared. Routes that are not in the map do not exist, so the
+        map never needs to go back to the database.
+
+        The map has the same interface as RouteCache and may be
+        shared between threads once it has been filled. The hit and miss
+        counts are not protected against concurrent updates and
+        therefore approximate.
+    """
+
+    def __init__(self, table, columns=None):
+        cols = _select_columns(table, columns)
+
+        self.sql = sa.select(*cols).order_by(table.c.id)
+        self.info_type = namedtuple('RouteInfo', [c.name for c in cols], rename=True)
+        self.ids = array('q')
+        self.values = [[] for _ in cols[1:]]
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, oid):
+        return self._find(oid) is not None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def preload(self, conn):
+        """ Load the information of all routes with a single query.
+        """
+        strings = {}
+        for row in conn.execute(self.sql):
+            self.ids.append(row[0])
+            for values, value in zip(self.values, row[1:]):
+                if isinstance(value, str):
+                    value = strings.setdefault(value, value)
+                values.append(value)
+
+        LOG.info("Preloaded information for %d routes.", len(self.ids))
+
+    def missing(self, ids):
+        """ Return the ids that need loading. This is never the case
+            for a preloaded map.
+        """
+        return []
+
+    def load(self, conn, ids):
+        """ Return the information for the given routes. Nothing needs
+            to be loaded from the database.
+        """
+        return {oid: info for oid in ids if (info := self._get(oid)) is not None}
+
+    def get(self, conn, oid):
+        """ Get the information for the route with the given id.
+            Returns None when the route does not exist.
+        """
+        info = self._get(oid)
+        if info is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return info
+
+    def log_statistics(self):
+        LOG.info("Route cache: %d hits, %d misses, %d routes preloaded.",
+                 self.hits, self.misses, len(self.ids))
+
+    def _find(self, oid):
+        idx = bisect_left(self.ids, oid)
+        if idx < len(self.ids) and self.ids[idx] == oid:
+            return idx
+        return None
+
+    def _get(self, oid):
+        idx = self._find(oid)
+        if idx is None:
+            return None
+
+        return self.info_type(oid, *(values[idx] for values in self.values))
@@ -0,0 +1,138 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This file is part of the Waymarked Trails Map Project
+# Copyright (C) 2024 Sarah Hoffmann
+""" Dependency-driven scheduling for processing relation hierarchies.
+"""
+from collections import defaultdict, deque
+from concurrent.futures import wait, FIRST_COMPLETED
+import logging
+import time
+
+LOG = logging.getLogger(__name__)
+
+class HierarchyScheduler:
+    """ Hands relations to a pool of workers as soon as all their child
+        relations have been processed.
+
+        Dependencies need to be registered with add_dependency() before
+        the first relation is added. Relations are then handed to
+        the scheduler via add() in any order. Relations without pending
+        children go out to the workers immediately, the others are
+        kept back until the last of their children is finished.
+        Children that are never added do not hold back their parents
+        once all relations have been handed in.
+
+        Relations are sent to the workers in lists of up to
+        'batch_size' objects. 'submit' must be a function that takes such
+        a list and returns a Future. A relation counts as done once
+        its future has finished.
+    """
+
+    def __init__(self, batch_size=1, max_pending=1):
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.parents = defaultdict(list)
+        self.waiting = defaultdict(int)
+        self.levels = {}
+        self.deferred = {}
+        self.ready = deque()
+        self.running = {}
+        self.submit = None
+        self.start_time = None
+        self.stats = {}
+
+    def add_dependency(self, parent, child):
+        """ Register that relation 'parent' can only be processed
+            after relation 'child' is done.
+        """
+        self.parents[child].append(parent)
+        self.waiting[parent] += 1
+
+    def set_level(self, oid, level):
+        """ Set the hierarchy level of the relation for statistics.
+            Relations without a level are assumed to be on the top level 1.
+        """
+        self.levels[oid] = level
+
+    def start(self, submit):
+        """ Set the submit function for handing out tasks and start
+            the timer for the statistics.
+        """
+        self.submit = submit
+        self.start_time = time.monotonic()
+
+    def add(self, obj):
+        """ Add a new relation to be processed.
+        """
+        if self.waiting.get(obj.id):
+            self.deferred[obj.id] = obj
+        else:
+            self.ready.append(obj)
+        self._dispatch()
+
+    def finish(self):
+        """ Wait until all relations have been processed.
+        """
+        while self.ready or self.deferred or self.running:
+            if self.ready:
+                self._dispatch(flush=True)
+            elif self.running:
+                self._collect()
+            elif not self._release_unknown():
+                # The remaining relations are waiting for each other,
+                # so there must be a cycle. Just process them all.
+                LOG.warning("Cycle detected in relations %s",
+                            ', '.join(str(i) for i in self.deferred))
+                self.ready.extend(self.deferred.values())
+                self.deferred.clear()
+
+    def log_statistics(self):
+        """ Print the time when the last relation of each level was done.
+        """
+        for level in sorted(self.stats, reverse=True):
+            count, finish = self.stats[level]
+            LOG.info("Level %d: %d relations done after %.1fs", level, count, finish)
+
+    def _dispatch(self, flush=False):
+        while len(self.ready) >= self.batch_size or (flush and self.ready):
+            if len(self.running) >= self.max_pending:
+                self._collect()
+                continue
+            num = min(self.batch_size, len(self.ready))
+            task = [self.ready.popleft() for _ in range(num)]
+            self.running[self.submit(task)] = task
+
+    def _collect(self):
+        done, _ = wait(self.running, return_when=FIRST_COMPLETED)
+        for future in done:
+            task = self.running.pop(future)
+            future.result() # reraises exceptions from the worker
+            for obj in task:
+                self._mark_done(obj.id)
+
+    def _release_unknown(self):
+        """ Release the parents of all children that have not been added.
+            Must only be called when no relations are ready or running.
+            Returns True if any relation could be released.
+        """
+        unknown = [oid for oid in self.parents if oid not in self.deferred]
+        for oid in unknown:
+            self._release(oid)
+
+        return bool(self.ready)
+
+    def _mark_done(self, oid):
+        stat = self.stats.setdefault(self.levels.get(oid, 1), [0, 0.0])
+        stat[0] += 1
+        stat[1] = time.monotonic() - self.start_time
+
+        self._release(oid)
+
+    def _release(self, oid):
+        for parent in self.parents.pop(oid, ()):
+            self.waiting[parent] -= 1
+            if self.waiting[parent] == 0:
+                del self.waiting[parent]
+                if (obj := self.deferred.pop(parent, None)) is not None:
+                    self.ready.append(obj)
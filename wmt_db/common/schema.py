@@ -0,0 +1,41 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This file is part of the Waymarked Trails Map Project
+# Copyright (C) 2024 Sarah Hoffmann
+""" Adaption of the schema of existing databases.
+"""
+import logging
+
+import sqlalchemy as sa
+
+LOG = logging.getLogger(__name__)
+
+def add_missing_columns(engine, tables):
+    """ Add all columns of the given tables that do not exist yet in the
+        database. Tables that do not exist are ignored. The new columns
+        are left empty. The tables fill them in when they need them.
+
+        Returns the number of columns added.
+    """
+    prep = engine.dialect.identifier_preparer
+    inspector = sa.inspect(engine)
+    num_added = 0
+
+    with engine.begin() as conn:
+        for table in tables:
+            if not inspector.has_table(table.name, schema=table.schema):
+                continue
+
+            existing = {c['name'] for c in inspector.get_columns(table.name,
+                                                                 schema=table.schema)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                LOG.warning("Adding missing column '%s' to table '%s'.",
+                            column.name, table.name)
+                conn.execute(sa.text('ALTER TABLE {} ADD COLUMN {} {}'.format(
+                                 prep.format_table(table), prep.quote(column.name),
+                                 column.type.compile(dialect=engine.dialect))))
+                num_added += 1
+
+    return num_added
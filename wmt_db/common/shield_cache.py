@@ -0,0 +1,66 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This file is part of the Waymarked Trails Map Project
+# Copyright (C) 2024 Sarah Hoffmann
+""" Deduplicated writing of shield files.
+"""
+import os
+import threading
+
+
+class ShieldCache:
+    """ Writes shield files into a directory, skipping all shields
+        that have already been written. Shields are identified by their
+        UUID. The cache may be used from multiple threads.
+
+        When 'preload' is set, shields already present in the directory
+        are not written again.
+
+        Each table should use its own cache and clear it when it is
+        done, so that the set of written shields does not stay around.
+    """
+
+    def __init__(self, datadir, preload=False):
+        self.datadir = datadir
+        self.preload = preload
+        self.loaded = False
+        self.written = set()
+        self.lock = threading.Lock()
+
+    def write(self, sym):
+        """ Write the given shield unless it is already available.
+            Returns the name of the shield or 'None' if there is no shield.
+        """
+        if sym is None:
+            return 'None'
+
+        uid = sym.uuid()
+        with self.lock:
+            if self.preload and not self.loaded:
+                self.written.update(f.stem for f in self.datadir.glob('*.svg'))
+                self.loaded = True
+            if uid in self.written:
+                return uid
+            self.written.add(uid)
+
+        # Write to a temporary file first, so that other processes
+        # writing the same shield never see a partial file.
+        tmpfile = self.datadir / f'.{uid}.{threading.get_ident()}.tmp'
+        try:
+            sym.to_file(tmpfile, format='svg')
+            os.replace(tmpfile, self.datadir / f'{uid}.svg')
+        except Exception:
+            tmpfile.unlink(missing_ok=True)
+            with self.lock:
+                self.written.discard(uid)
+            raise
+
+        return uid
+
+    def clear(self):
+        """ Forget about all written shields. With 'preload' set, the
+            directory is read again on the next write.
+        """
+        with self.lock:
+            self.written = set()
+            self.loaded = False
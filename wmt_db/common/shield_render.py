@@ -0,0 +1,114 @@
+# SPDX-License-Identifier: GPL-3.0-only
+#
+# This file is part of the Waymarked Trails Map Project
+# Copyright (C) 2024 Sarah Hoffmann
+""" Bulk rendering of shields, optionally in parallel.
+"""
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import importlib
+import logging
+import multiprocessing
+import time
+
+from osgende.common.tags import TagStore
+
+LOG = logging.getLogger(__name__)
+
+_WORKER_FACTORY = None
+
+def _init_worker(config_name):
+    global _WORKER_FACTORY
+    from wmt_shields import ShieldFactory
+
+    site_config = importlib.import_module(config_name)
+    _WORKER_FACTORY = ShieldFactory(site_config.ROUTES.symbols, site_config.SYMBOLS)
+
+
+def _render_shield(fname, tags, args, kwargs):
+    sym = _WORKER_FACTORY.create(TagStore(tags), *args, **kwargs)
+    sym.to_file(fname, format='svg')
+
+
+class ShieldRenderer:
+    """ Renders the shields for a stream of routes into the symbol
+        directory of the given site configuration.
+
+        Shields are deduplicated by their UUID before rendering, so
+        that each shield is rendered only once. When 'num_processes'
+        is larger than 0, the rendering is done in a pool of worker
+        processes. Progress is logged in regular intervals.
+    """
+    LOG_INTERVAL = 10
+
+    def __init__(self, factory, site_config, num_processes=0, total=None):
+        self.factory = factory
+        self.datadir = site_config.ROUTES.symbol_datadir
+        self.total = total
+        self.done = set()
+        self.num_routes = 0
+        self.pending = set()
+
+        if num_processes:
+            self.pool = ProcessPoolExecutor(max_workers=num_processes,
+                                            mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_init_worker,
+                                            initargs=(site_config.__name__, ))
+            self.max_pending = 4 * num_processes
+        else:
+            self.pool = None
+
+        self.start_time = time.monotonic()
+        self.next_log = self.start_time + self.LOG_INTERVAL
+
+    def add(self, tags, *args, **kwargs):
+        """ Render the shield for a route with the given tags. Any
+            additional parameters are handed to the create() function
+            of the shield factory.
+        """
+        self.num_routes += 1
+
+        sym = self.factory.create(TagStore(tags), *args, **kwargs)
+        if sym is not None:
+            uid = sym.uuid()
+            if uid not in self.done:
+                self.done.add(uid)
+                fname = self.datadir / f'{uid}.svg'
+                if self.pool is None:
+                    sym.to_file(fname, format='svg')
+                else:
+                    if len(self.pending) >= self.max_pending:
+                        self._collect(FIRST_COMPLETED)
+                    self.pending.add(self.pool.submit(_render_shield, fname,
+                                                      dict(tags), args, kwargs))
+
+        if time.monotonic() >= self.next_log:
+            self._log_progress()
+
+    def finish(self):
+        """ Wait for all shields to be rendered.
+        """
+        if self.pool is not None:
+            self._collect()
+            self.pool.shutdown()
+        self._log_progress()
+
+    def _collect(self, return_when='ALL_COMPLETED'):
+        done, self.pending = wait(self.pending, return_when=return_when)
+        for future in done:
+            future.result()
+
+    def _log_progress(self):
+        now = time.monotonic()
+        self.next_log = now + self.LOG_INTERVAL
+        elapsed = max(now - self.start_time, 0.001)
+        rate = self.num_routes / elapsed
+
+        if self.total and rate > 0:
+            eta = f", ETA {(self.total - self.num_routes) / rate:.0f}s"
+            routes = f"{self.num_routes}/{self.total}"
+        else:
+            eta = ''
+            routes = str(self.num_routes)
+
+        LOG.info("%s routes (%.0f/s), %d distinct shields%s",
+                 routes, rate, len(self.done), eta)
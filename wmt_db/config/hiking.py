@@ -4,6 +4,9 @@
 # Copyright (C) 2021 Sarah Hoffmann
 
 from types import MethodType
+
+import sqlalchemy as sa
+
 from ..styles.route_network_style import RouteNetworkStyle
 from ..common.route_types import Network
 from wmt_shields.wmt_config import WmtConfig
@@ -84,6 +87,11 @@ def hiking_add_to_collector(self, c, relinfo):
         c['cldrels'].append(relinfo.id)
 
 
+def hiking_custom_routes(routes):
+    # routes that hiking_add_to_collector() handles differently
+    return sa.and_(routes.c.top.is_(True), routes.c.network.startswith('AL'))
+
+
 MAPTYPE = 'routes'
 
 DB_SCHEMA = 'hiking'
@@ -96,6 +104,7 @@ DB_ROUTE_SUBSET = """
 
 DEFSTYLE = RouteNetworkStyle()
 DEFSTYLE.add_to_collector = MethodType(hiking_add_to_collector, DEFSTYLE)
+DEFSTYLE.custom_routes = hiking_custom_routes
 
 ROUTES = RouteTableConfig()
 ROUTES.network_map = {
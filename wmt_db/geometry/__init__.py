@@ -4,4 +4,6 @@
 # Copyright (C) 2024 Sarah Hoffmann
 
 from .route_builder import (build_route as build_route)
-from .member_loader import (get_relation_objects as get_relation_objects)
+from .member_loader import (get_relation_objects as get_relation_objects,
+                            load_member_data as load_member_data,
+                            make_relation_objects as make_relation_objects)
@@ -0,0 +1,175 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+# This file is part of the Waymarked Trails Map Project
+# Copyright (C) 2024 Sarah Hoffmann
+""" CPU-bound part of building a route relation.
+
+    The functions in here do not access the database. All their
+    parameters and results can be pickled, so that they may be run
+    in a separate process.
+"""
+import shapely
+from osgende.common.tags import TagStore
+
+from ..common.data_transforms import fix_route_geometry
+from . import route_types as rt
+from .member_loader import make_relation_objects
+from .route_builder import build_route
+from .route_binary import dump_route, load_route
+
+def assemble_route(members, member_data):
+    """ Build the route and the final geometries for a relation.
+
+        'members' is the filtered member list of the relation and
+        'member_data' the raw member data as returned by
+        load_member_data() with geometries.
+
+        Returns a tuple of fixed geometry, render geometry,
+        route serialized as JSON, route in binary serialization and
+        linear state of the route. Returns None if the relation has no
+        geometry.
+    """
+    geom = build_member_geometry(members, member_data)
+    if geom is None:
+        return None
+
+    geom, render_geom = fix_route_geometry(geom)
+
+    route_members = make_relation_objects(members, member_data)
+    assert len(route_members) > 0
+    route = build_route(route_members)
+
+    return geom, render_geom, route.to_json(), dump_route(route), route.get_linear_state()
+
+
+def patch_route(route_data, members, member_data, changed_ways):
+    """ Update a previously built route after some of its member ways
+        have changed. Member list and child relations must be unchanged.
+
+        'route_data' is the binary serialization of the previous route,
+        'changed_ways' the set of IDs of member ways that have changed.
+        The other parameters are the same as for assemble_route().
+
+        The structure of a route only depends on the end points of its
+        ways, so the previous route can be reused as long as all changed
+        ways have kept their end points. Only geometry, tags and lengths
+        of the changed ways are replaced and start points recomputed.
+
+        Returns the same tuple as assemble_route() or None, when the
+        route cannot be patched and needs to be rebuilt from scratch.
+    """
+    route = load_route(route_data)
+
+    patched = set()
+    for way in _direct_ways(route):
+        if way.osm_id not in changed_ways:
+            continue
+        if (raw := member_data.get(('W', way.osm_id))) is None:
+            return None
+        tags, length, coords, endpoints = raw
+        new_way = rt.BaseWay(way.osm_id, TagStore(tags), length, 0,
+                             coords=coords, endpoints=endpoints)
+        # Closed ways and split roundabouts have no clear orientation.
+        if new_way.is_closed or way.is_closed:
+            return None
+        if new_way.first == way.last and new_way.last == way.first:
+            new_way.reverse()
+        elif new_way.first != way.first or new_way.last != way.last:
+            return None
+
+        way.tags = new_way.tags
+        way.length = new_way.length
+        way.coords = new_way.coords
+        patched.add(way.osm_id)
+
+    # Ways that were not part of the route before (for example because
+    # they had no geometry) need a complete rebuild.
+    if patched != set(changed_ways):
+        return None
+
+    geom = build_member_geometry(members, member_data)
+    if geom is None:
+        return None
+    geom, render_geom = fix_route_geometry(geom)
+
+    _update_lengths(route)
+    route.adjust_start_point(route.start or 0)
+
+    return geom, render_geom, route.to_json(), dump_route(route), route.get_linear_state()
+
+
+def _direct_ways(seg):
+    """ Iterate over all ways of the given route that do not belong
+        to a child route.
+    """
+    if isinstance(seg, rt.BaseWay):
+        yield seg
+    elif isinstance(seg, rt.WaySegment):
+        yield from seg.ways
+    else:
+        if isinstance(seg, rt.SplitSegment):
+            subs = seg.forward + seg.backward
+        elif isinstance(seg, rt.AppendixSegment):
+            subs = seg.main
+        else:
+            subs = seg.main + seg.appendices
+        for sub in subs:
+            if not isinstance(sub, rt.RouteSegment):
+                yield from _direct_ways(sub)
+
+
+def _update_lengths(seg, top=True):
+    """ Recompute the lengths of the segments of a route that do not
+        belong to a child route. Returns the new length of the segment.
+    """
+    if isinstance(seg, rt.BaseWay):
+        return seg.length
+    if isinstance(seg, rt.WaySegment):
+        seg.length = sum(w.length for w in seg.ways)
+    elif isinstance(seg, rt.SplitSegment):
+        seg.length = sum(_update_lengths(s, False) for s in seg.forward)
+        for s in seg.backward:
+            _update_lengths(s, False)
+    elif isinstance(seg, rt.AppendixSegment):
+        seg.length = sum(_update_lengths(s, False) for s in seg.main)
+    elif top:
+        seg.length = sum(_update_lengths(s, False) for s in seg.main)
+        for s in seg.appendices:
+            _update_lengths(s, False)
+
+    return seg.length
+
+
+def build_member_geometry(members, member_data):
+    """ Build the raw geometry of a relation from the geometries of
+        its members: all distinct member ways and the geometries of
+        all child relations are collected into a single
+        MultiLineString. Returns None if no member has a geometry.
+    """
+    lines = []
+    done = set()
+    for m in members:
+        key = (m['type'], m['id'])
+        if key in done or (raw := member_data.get(key)) is None:
+            continue
+        done.add(key)
+
+        if key[0] == 'W':
+            lines.append(shapely.linestrings(raw[2]))
+        elif (geom := raw[1]) is not None:
+            if geom.geom_type == 'LineString':
+                lines.append(geom)
+            else:
+                lines.extend(shapely.get_parts(geom))
+
+    return shapely.MultiLineString(lines) if lines else None
+
+
+def select_member_data(members, member_data):
+    """ Reduce the raw member data to the entries needed by the given
+        member list. This keeps the data that needs to be sent to
+        a worker process small when the data was loaded for a whole batch
+        of relations.
+    """
+    return {k: member_data[k] for k in ((m['type'], m['id']) for m in members)
+            if k in member_data}
@@ -5,14 +5,17 @@
 """ Main function for building a complex route geometry.
 """
 import json
-from copy import deepcopy
+import struct
 
+import numpy as np
+import shapely
 import sqlalchemy as sa
 from geoalchemy2.shape import to_shape
 from geoalchemy2 import Geography
 from osgende.common.tags import TagStore
 
 from . import route_types as rt
+from .route_binary import load_route
 
 def get_relation_objects(conn, members, way_table, route_table):
     """ Load all necessary data for relation members from the database.
@@ -21,50 +24,140 @@ def get_relation_objects(conn, members, way_table, route_table):
         Routes (for relations) with an additional 'role' property set
         to the member list.
     """
+    data = load_member_data(conn, members, way_table, route_table)
+
+    return make_relation_objects(members, data)
+
+
+def load_member_data(conn, members, way_table, route_table, with_geometry=False):
+    """ Load the raw data for the given members from the database.
+
+        'members' may be the concatenated member lists of multiple
+        relations, so that the data for a whole batch of relations
+        can be loaded with one query per member type. The result
+        is a dictionary that can be handed to make_relation_objects().
+
+        When 'with_geometry' is set, the geometries of child relations
+        are loaded as well, so that the geometry of the relation can
+        be built from the same data.
+
+        The geometries of ways are always loaded. Linking the ways only
+        needs the precomputed end points but the route output and the
+        relation geometry contain the full way geometries. Only the
+        length and the end points are taken from the way table instead
+        of being computed from the geometry.
+    """
     data = {}
 
-    ways = [m['id'] for m in members if m['type'] == 'W']
+    ways = list({m['id'] for m in members if m['type'] == 'W'})
     if ways:
         t = way_table
-        sql = sa.select(t.c.id, t.c.geom, t.c.tags,
-                        sa.func.ST_Length(sa.func.ST_Transform(t.c.geom, 4326)
-                          .cast(Geography)).label('length'))\
+        length = sa.func.ST_Length(sa.func.ST_Transform(t.c.geom, 4326).cast(Geography))
+        # Use the precomputed length where available. The geography
+        # function is evaluated only for rows that do not have it.
+        if 'length' in t.c:
+            length = sa.func.coalesce(t.c.length, length)
+        if 'endpoints' in t.c:
+            endpoints = t.c.endpoints
+        else:
+            endpoints = sa.null()
+        sql = sa.select(t.c.id, sa.func.ST_AsBinary(t.c.geom).label('wkb'),
+                        t.c.tags, length.label('length'),
+                        endpoints.label('endpoints'))\
                 .where(t.c.id.in_(ways))\
-                .where(t.c.geom is not None)
+                .where(t.c.geom.is_not(None))
         for way in conn.execute(sql):
-            data[('W', way.id)] = rt.BaseWay(osm_id=way.id,
-                                             tags=TagStore(way.tags or {}),
-                                             length=int(way.length), direction=0,
-                                             geom=to_shape(way.geom))
-
+            if (pts := way.endpoints) is not None:
+                pts = ((pts[0], pts[1]), (pts[2], pts[3]))
+            data[('W', way.id)] = (way.tags or {}, int(way.length),
+                                   linestring_coords(way.wkb), pts)
 
-    rels = [m['id'] for m in members if m['type'] == 'R']
+    rels = list({m['id'] for m in members if m['type'] == 'R'})
     if rels:
         t = route_table
-        sql = sa.select(t.c.id, t.c.route)\
-                .where(t.c.id.in_(rels))\
-                .where(t.c.route is not None)
+        # Prefer the binary serialization of the route, it is much
+        # faster to decode. Fall back to JSON for tables without it.
+        if 'route_data' in t.c:
+            sql = sa.select(t.c.id, t.c.route_data,
+                            sa.case((t.c.route_data.is_(None), t.c.route)).label('route'))
+        else:
+            sql = sa.select(t.c.id, sa.null().label('route_data'), t.c.route)
+        if with_geometry:
+            sql = sql.add_columns(t.c.geom)
+        sql = sql.where(t.c.id.in_(rels)).where(t.c.route.is_not(None))
 
         for rel in conn.execute(sql):
-            rte = json.loads(rel.route, object_hook=rt.json_decoder_hook)
-            rte.id = rel.id
-            data[('R', rel.id)] = rte
+            geom = to_shape(rel.geom) if with_geometry and rel.geom is not None else None
+            if rel.route_data is not None:
+                data[('R', rel.id)] = (bytes(rel.route_data), geom)
+            else:
+                data[('R', rel.id)] = (rel.route, geom)
+
+    return data
+
 
+def linestring_coords(wkb):
+    """ Return the coordinates of a linestring given as WKB
+        as an array of shape (n, 2).
+
+        2D linestrings are read directly from the WKB without
+        creating an intermediate Shapely geometry.
+    """
+    data = memoryview(wkb)
+    order = '<' if data[0] == 1 else '>'
+    geom_type, npoints = struct.unpack_from(order + 'II', data, 1)
+    if geom_type != 2:
+        return shapely.get_coordinates(shapely.from_wkb(bytes(data)))
+
+    return np.frombuffer(data, dtype=order + 'f8', count=2 * npoints,
+                         offset=9).reshape(-1, 2)
+
+
+def make_relation_objects(members, data):
+    """ Create the list of route objects for the given members from
+        the raw data returned by load_member_data().
+
+        Fresh objects are created on each call, so the same data may
+        be used to build multiple relations.
+    """
+    objs = {}
     finallist = []
     for i, m in enumerate(members):
         key = (m['type'], m['id'])
-        if (seg := data.get(key)) is not None:
+        if (seg := objs.get(key)) is None:
+            if (raw := data.get(key)) is None:
+                continue
+            seg = _make_object(key, raw)
+            objs[key] = seg
+        else:
             # If a way appears two times, we need to make a copy because
             # the way may be reversed and moved around later.
-            if seg.start is not None:
-                seg = deepcopy(seg)
-            seg.start = i
-            seg.direction, seg.role = adjust_role(seg, m['role'])
-            finallist.append(seg)
+            seg = seg.clone()
+        seg.start = i
+        seg.direction, seg.role = adjust_role(seg, m['role'])
+        finallist.append(seg)
 
     return finallist
 
 
+def _make_object(key, raw):
+    if key[0] == 'W':
+        tags, length, coords, endpoints = raw
+        return rt.BaseWay(osm_id=key[1], tags=TagStore(tags),
+                          length=length, direction=0, coords=coords,
+                          endpoints=endpoints)
+
+    raw = raw[0]
+    if isinstance(raw, str):
+        rte = json.loads(raw, object_hook=rt.json_decoder_hook)
+    else:
+        # Most of the time, only the end points of a child route are
+        # needed to build the parent, so defer decoding of the full tree.
+        rte = load_route(raw, lazy=True)
+    rte.id = key[1]
+    return rte
+
+
 def adjust_role(seg, role) -> tuple[int, str]:
     match role:
         case 'forward':
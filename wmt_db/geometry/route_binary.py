@@ -0,0 +1,370 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+# This file is part of the Waymarked Trails Map Project
+# Copyright (C) 2024 Sarah Hoffmann
+""" Compact binary serialization of route trees.
+
+    The binary format holds the same information as the JSON
+    serialization of the route types but stores coordinates as packed
+    double values, which makes encoding and decoding a lot cheaper.
+
+    A serialized route starts with a header containing a magic number,
+    the format version and a summary of the route (first and last point
+    in both directions, distance covered from the start point to the end
+    point including gaps, linear state of the complete route). The remainder is the route tree.
+    Each node starts with a single byte for the node type followed by the
+    fixed-size fields of the node type, variable-size fields and finally
+    the child nodes. All numbers are little endian.
+"""
+import dataclasses
+from copy import copy
+import struct
+
+import numpy as np
+from osgende.common.tags import TagStore
+
+from . import route_types as rt
+
+MAGIC = b'WMTR'
+VERSION = 2
+
+_MAGIC_VERSION = struct.Struct('<4sB')
+_HEADER_V1 = struct.Struct('<ddddq')
+_HEADER = struct.Struct('<ddddddddq')
+_BASE_WAY = struct.Struct('<qqqbI')
+_WAY_SEGMENT = struct.Struct('<qqI')
+_SPLIT_SEGMENT = struct.Struct('<qqddddII')
+_APPENDIX_SEGMENT = struct.Struct('<qqqI')
+_ROUTE_SEGMENT = struct.Struct('<qqqII')
+_UINT = struct.Struct('<I')
+
+# Integer fields may be None. This value stands in for None.
+_NONE = -2**63
+
+_TYPE_BASE_WAY = b'b'
+_TYPE_WAY_SEGMENT = b'w'
+_TYPE_SPLIT_SEGMENT = b's'
+_TYPE_APPENDIX_SEGMENT = b'a'
+_TYPE_ROUTE_SEGMENT = b'r'
+
+
+def dump_route(route: rt.RouteSegment) -> bytes:
+    """ Serialize the given route into the binary format.
+    """
+    if route.main:
+        first, last = route.first, route.last
+        # The end points of the reversed route cannot be derived from
+        # the points above, when the route begins or ends with a split.
+        rfirst, rlast = route.main[-1].clone(), route.main[0].clone()
+        rfirst.reverse()
+        rlast.reverse()
+        rfirst, rlast = rfirst.first, rlast.last
+        # The start points of a finished route are already set, so this
+        # does not change the route, it only computes the end point.
+        start = route.start or 0
+        span = route.adjust_start_point(start) - start
+    else:
+        first = last = rfirst = rlast = (float('nan'), float('nan'))
+        span = 0
+
+    out = [_MAGIC_VERSION.pack(MAGIC, VERSION),
+           _HEADER.pack(*first, *last, *rfirst, *rlast, span),
+           _pack_str(route.get_linear_state())]
+    _dump_node(out, route)
+
+    return b''.join(out)
+
+
+def load_route(data: bytes, lazy: bool = False) -> rt.RouteSegment:
+    """ Create a route tree from its binary serialization.
+
+        With 'lazy', a LazyRouteSegment is returned, which decodes
+        the children of the route only when they are accessed.
+    """
+    if lazy:
+        return LazyRouteSegment(data)
+
+    reader = _Reader(data)
+    read_header(reader)
+    return reader.node()
+
+
+def read_header(reader):
+    """ Read the route header from a reader positioned at the beginning
+        of the data. Returns a tuple of first point, last point, end points
+        of the reversed route, span and linear state of the route.
+        The points are None for an empty route. The end points of the
+        reversed route are None for data written in version 1.
+    """
+    magic, version = reader.unpack(_MAGIC_VERSION)
+    if magic != MAGIC:
+        raise ValueError("Data is not a binary route.")
+    if version == 1:
+        x0, y0, x1, y1, span = reader.unpack(_HEADER_V1)
+        reversed_ends = None
+    elif version == VERSION:
+        x0, y0, x1, y1, rx0, ry0, rx1, ry1, span = reader.unpack(_HEADER)
+        reversed_ends = (rx0, ry0), (rx1, ry1)
+    else:
+        raise ValueError(f"Unsupported binary route version {version}.")
+
+    if x0 != x0:  # NaN, route without segments
+        return None, None, None, span, reader.str()
+
+    return (x0, y0), (x1, y1), reversed_ends, span, reader.str()
+
+
+class LazyRouteSegment(rt.RouteSegment):
+    """ A RouteSegment that is created from its binary serialization
+        and decodes its children only when they are accessed.
+
+        The end points, length and linear state of the route are available
+        from the header. Reversing the route and adjusting its start point
+        are recorded and only applied when the children are decoded.
+        Start points of the children depend on the direction of the
+        route, so at most one of the two operations is deferred.
+        Data in version 1 of the format has no end points for the
+        reversed route and is decoded when reversed.
+    """
+
+    def __init__(self, data: bytes) -> None:
+        self._data = data
+        reader = _Reader(data)
+        self._first, self._last, self._reversed_ends, self._span, self._linear_state \
+            = read_header(reader)
+        self._reversed = False
+        self._start_before_adjust = None
+
+        length, start, osm_id, _, _, linear, role = reader.route_fields()
+        self.length = length
+        self.linear = linear
+        self.direction = 0
+        self.role = role
+        self.start = start
+        self.id = osm_id
+
+    def __getattr__(self, name):
+        # Only called when the attribute is not set yet.
+        if name in ('main', 'appendices') and '_data' in self.__dict__:
+            self._decode()
+            return self.__dict__[name]
+
+        raise AttributeError(name)
+
+    def __eq__(self, other):
+        if not isinstance(other, rt.RouteSegment):
+            return NotImplemented
+
+        return all(getattr(self, f.name) == getattr(other, f.name)
+                   for f in dataclasses.fields(rt.RouteSegment))
+
+    @property
+    def is_decoded(self) -> bool:
+        return 'main' in self.__dict__
+
+    @property
+    def first(self) -> tuple[float, float]:
+        if self.is_decoded:
+            return self.main[0].first
+        return self._reversed_ends[0] if self._reversed else self._first
+
+    @property
+    def last(self) -> tuple[float, float]:
+        if self.is_decoded:
+            return self.main[-1].last
+        return self._reversed_ends[1] if self._reversed else self._last
+
+    def reverse(self) -> None:
+        if self.is_decoded or self._start_before_adjust is not None \
+           or self._reversed_ends is None:
+            super().reverse()
+        else:
+            self.direction = -self.direction
+            self._reversed = not self._reversed
+
+    def clone(self) -> rt.RouteSegment:
+        if self.is_decoded:
+            return super().clone()
+        # Not decoded yet, so the state is immutable apart from
+        # the scalar fields. The binary data can be shared.
+        return copy(self)
+
+    def get_linear_state(self) -> str:
+        if self.is_decoded:
+            return super().get_linear_state()
+        return self._linear_state
+
+    def adjust_start_point(self, start: int) -> int:
+        if self.is_decoded or self._reversed:
+            return super().adjust_start_point(start)
+
+        if self._start_before_adjust is None:
+            self._start_before_adjust = (self.start, )
+        self.start = start
+        return start + self._span
+
+    def _decode(self) -> None:
+        reader = _Reader(self._data)
+        read_header(reader)
+        _, _, _, nmain, nappendices, _, _ = reader.route_fields()
+        self.main = reader.nodes(nmain)
+        self.appendices = reader.nodes(nappendices)
+
+        if self._reversed:
+            self._reversed = False
+            self.main.reverse()
+            for s in self.main:
+                s.reverse()
+
+        if self._start_before_adjust is not None:
+            start = self.start
+            self.start = self._start_before_adjust[0]
+            self._start_before_adjust = None
+            super().adjust_start_point(start)
+
+
+def _int(value):
+    return _NONE if value is None else value
+
+
+def _opt_int(value):
+    return None if value == _NONE else value
+
+
+def _pack_str(value):
+    data = value.encode('utf-8')
+    return _UINT.pack(len(data)) + data
+
+
+def _dump_list(out, objs):
+    for obj in objs:
+        _dump_node(out, obj)
+
+
+def _dump_node(out, obj):
+    if isinstance(obj, rt.BaseWay):
+        coords = obj.coords
+        out.append(_TYPE_BASE_WAY)
+        out.append(_BASE_WAY.pack(obj.osm_id, _int(obj.start), obj.length,
+                                  obj.direction, len(coords)))
+        out.append(_pack_str(obj.role or ''))
+        out.append(_UINT.pack(len(obj.tags)))
+        for k, v in obj.tags.items():
+            out.append(_pack_str(k))
+            out.append(_pack_str(v))
+        out.append(coords.astype('<f8', copy=False).tobytes())
+    elif isinstance(obj, rt.WaySegment):
+        out.append(_TYPE_WAY_SEGMENT)
+        out.append(_WAY_SEGMENT.pack(obj.length, _int(obj.start), len(obj.ways)))
+        _dump_list(out, obj.ways)
+    elif isinstance(obj, rt.SplitSegment):
+        out.append(_TYPE_SPLIT_SEGMENT)
+        out.append(_SPLIT_SEGMENT.pack(obj.length, _int(obj.start),
+                                       *obj.first, *obj.last,
+                                       len(obj.forward), len(obj.backward)))
+        _dump_list(out, obj.forward)
+        _dump_list(out, obj.backward)
+    elif isinstance(obj, rt.AppendixSegment):
+        out.append(_TYPE_APPENDIX_SEGMENT)
+        out.append(_APPENDIX_SEGMENT.pack(obj.length, _int(obj.start),
+                                          _int(obj.end), len(obj.main)))
+        _dump_list(out, obj.main)
+    elif isinstance(obj, rt.RouteSegment):
+        out.append(_TYPE_ROUTE_SEGMENT)
+        out.append(_ROUTE_SEGMENT.pack(obj.length, _int(obj.start), _int(obj.id),
+                                       len(obj.main), len(obj.appendices)))
+        out.append(_pack_str(obj.linear or ''))
+        out.append(_pack_str('' if obj.role is None else obj.role))
+        out.append(b'\x01' if obj.role is None else b'\x00')
+        _dump_list(out, obj.main)
+        _dump_list(out, obj.appendices)
+    else:
+        raise TypeError(f"Cannot serialize object of type {type(obj)}.")
+
+
+class _Reader:
+    """ Sequential reader for the binary route format.
+    """
+
+    def __init__(self, data: bytes) -> None:
+        self.data = memoryview(data)
+        self.pos = 0
+
+    def unpack(self, fmt):
+        values = fmt.unpack_from(self.data, self.pos)
+        self.pos += fmt.size
+        return values
+
+    def str(self):
+        size, = _UINT.unpack_from(self.data, self.pos)
+        self.pos += _UINT.size
+        value = str(self.data[self.pos:self.pos + size], 'utf-8')
+        self.pos += size
+        return value
+
+    def route_fields(self):
+        """ Read the fields of a route node up to its children. The
+            reader must be positioned on the node type.
+        """
+        node_type = self.data[self.pos:self.pos + 1].tobytes()
+        if node_type != _TYPE_ROUTE_SEGMENT:
+            raise ValueError(f"Expected route node, got {node_type!r}.")
+        self.pos += 1
+
+        length, start, osm_id, nmain, nappendices = self.unpack(_ROUTE_SEGMENT)
+        linear = self.str() or None
+        role = self.str()
+        if self.data[self.pos]:
+            role = None
+        self.pos += 1
+
+        return length, _opt_int(start), _opt_int(osm_id), nmain, nappendices, linear, role
+
+    def nodes(self, num):
+        return [self.node() for _ in range(num)]
+
+    def node(self):
+        node_type = self.data[self.pos:self.pos + 1].tobytes()
+        self.pos += 1
+
+        if node_type == _TYPE_BASE_WAY:
+            osm_id, start, length, direction, ncoords = self.unpack(_BASE_WAY)
+            role = self.str()
+            ntags, = self.unpack(_UINT)
+            tags = {}
+            for _ in range(ntags):
+                k = self.str()
+                tags[k] = self.str()
+            coords = np.frombuffer(self.data, dtype='<f8', count=2 * ncoords,
+                                   offset=self.pos).reshape(-1, 2)
+            self.pos += coords.nbytes
+            return rt.BaseWay(osm_id=osm_id, tags=TagStore(tags), length=length,
+                              direction=direction, coords=coords,
+                              role=role, start=_opt_int(start))
+
+        if node_type == _TYPE_WAY_SEGMENT:
+            length, start, nways = self.unpack(_WAY_SEGMENT)
+            return rt.WaySegment(length=length, start=_opt_int(start),
+                                 ways=self.nodes(nways))
+
+        if node_type == _TYPE_SPLIT_SEGMENT:
+            length, start, x0, y0, x1, y1, nfwd, nbwd = self.unpack(_SPLIT_SEGMENT)
+            forward = self.nodes(nfwd)
+            return rt.SplitSegment(length=length, start=_opt_int(start),
+                                   first=(x0, y0), last=(x1, y1),
+                                   forward=forward, backward=self.nodes(nbwd))
+
+        if node_type == _TYPE_APPENDIX_SEGMENT:
+            length, start, end, nmain = self.unpack(_APPENDIX_SEGMENT)
+            return rt.AppendixSegment(length=length, start=_opt_int(start),
+                                      end=_opt_int(end), main=self.nodes(nmain))
+
+        if node_type == _TYPE_ROUTE_SEGMENT:
+            self.pos -= 1
+            length, start, osm_id, nmain, nappendices, linear, role = self.route_fields()
+            main = self.nodes(nmain)
+            return rt.RouteSegment(length=length, start=start, id=osm_id,
+                                   linear=linear, role=role,
+                                   main=main, appendices=self.nodes(nappendices))
+
+        raise ValueError(f"Unknown node type {node_type!r} in binary route.")
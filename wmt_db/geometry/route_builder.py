@@ -139,31 +139,39 @@ def _flip_order(segments: list[rt.AnySegment]) -> None:
     """ Recheck the order of flippable segments. They might still
         need to be flipped according to their neighbours.
     """
+    # Roundabouts are neighbours of up to two segments, so cache their points.
+    roundabout_points = {}
+
+    def _on_roundabout(pt, idx):
+        if not segments[idx].is_roundabout():
+            return False
+        if (pts := roundabout_points.get(idx)) is None:
+            pts = roundabout_points[idx] = set(map(tuple, segments[idx].ways[0].coords.tolist()))
+        return pt in pts
+
     for i, seg in enumerate(segments):
         if not seg.is_reversable() or seg.is_roundabout():
             continue
         if i > 0:
             prev = segments[i - 1]
-            if prev.last == seg.first \
-               or (prev.is_roundabout() and seg.first in prev.ways[0].geom.coords):
+            if prev.last == seg.first or _on_roundabout(seg.first, i - 1):
                continue
         if i < len(segments) - 1:
             nxt = segments[i + 1]
             if seg.last == nxt.first \
-               or (nxt.is_roundabout() and seg.last in nxt.ways[0].geom.coords) \
+               or _on_roundabout(seg.last, i + 1) \
                or (nxt.is_reversable() and seg.last == nxt.last):
                 continue
 
         if i > 0:
             prev = segments[i - 1]
-            if prev.last == seg.last \
-               or (prev.is_roundabout() and seg.last in prev.ways[0].geom.coords):
+            if prev.last == seg.last or _on_roundabout(seg.last, i - 1):
                 seg.reverse()
                 continue
         if i < len(segments) - 1:
             nxt = segments[i + 1]
             if seg.first == nxt.first \
-               or (nxt.is_roundabout() and seg.first in nxt.ways[0].geom.coords) \
+               or _on_roundabout(seg.first, i + 1) \
                or (nxt.is_reversable() and seg.first == nxt.last):
                 seg.reverse()
 
@@ -192,27 +200,27 @@ def _process_oneways(segments: rt.BaseSegmentView, outlist: list[rt.AnySegment])
     """ Create a sequence of split segments from the given list of base segments
         and it to the 'outlist'.
     """
-    start_points = []
+    start_points = set()
     if (prevseg := segments.get_predecessor()) is not None:
         if prevseg.is_roundabout():
-            start_points.extend(prevseg.ways[0].geom.coords)
+            start_points.update(map(tuple, prevseg.ways[0].coords.tolist()))
         else:
-            start_points.append(prevseg.last)
+            start_points.add(prevseg.last)
             if prevseg.is_reversable():
                 prevprevseg = segments.get_predecessor(2)
                 if prevprevseg is None or prevseg.first != prevprevseg.last:
-                    start_points.append(prevseg.first)
+                    start_points.add(prevseg.first)
 
-    end_points = []
+    end_points = set()
     if (nextseg := segments.get_successor()) is not None:
         if nextseg.is_roundabout():
-            end_points.extend(nextseg.ways[0].geom.coords)
+            end_points.update(map(tuple, nextseg.ways[0].coords.tolist()))
         else:
-            end_points.append(nextseg.first)
+            end_points.add(nextseg.first)
             if nextseg.is_reversable():
                 nextnextseg = segments.get_successor(2)
                 if nextnextseg is None or nextseg.last != nextnextseg.first:
-                    end_points.append(nextseg.last)
+                    end_points.add(nextseg.last)
 
     if len(segments) == 1:
         seg = segments[0]
@@ -236,15 +244,17 @@ def _make_roundabout(segments: list[rt.AnySegment], pos: int) -> None:
     if seg.direction == -1:
         seg.reverse()
 
-    points = list(seg.geom.coords)
+    points = list(map(tuple, seg.coords.tolist()))
     prev = segments[pos - 1] if pos > 0 else None
     nxt = segments[pos + 1] if pos < len(segments) - 1 else None
 
+    # position of the first occurence of each point
+    point_index = {}
+    for i, pt in enumerate(points):
+        point_index.setdefault(pt, i)
+
     def _find_point(pt):
-        try:
-            return points.index(pt)
-        except ValueError:
-            return None
+        return point_index.get(pt)
 
     # forward direction
     if prev is not None:
@@ -253,14 +263,8 @@ def _make_roundabout(segments: list[rt.AnySegment], pos: int) -> None:
         spt = None
     if nxt is not None:
         if nxt.is_roundabout():
-            for pt in nxt.ways[0].geom.coords:
-                try:
-                    ept = points.index(pt)
-                    break
-                except ValueError:
-                    pass
-            else:
-                ept = None
+            ept = next((point_index[pt] for pt in map(tuple, nxt.ways[0].coords.tolist())
+                        if pt in point_index), None)
         else:
             ept = _find_point(nxt.forward[0].first if isinstance(nxt, rt.SplitSegment) else nxt.first)
     else:
@@ -283,14 +287,8 @@ def _make_roundabout(segments: list[rt.AnySegment], pos: int) -> None:
         spt = None
     if nxt is not None:
         if nxt.is_roundabout():
-            for pt in nxt.ways[0].geom.coords:
-                try:
-                    ept = points.index(pt)
-                    break
-                except ValueError:
-                    pass
-            else:
-                ept = None
+            ept = next((point_index[pt] for pt in map(tuple, nxt.ways[0].coords.tolist())
+                        if pt in point_index), None)
         else:
             ept = _find_point(nxt.backward[0].first if isinstance(nxt, rt.SplitSegment) else nxt.first)
     else:
@@ -330,7 +328,7 @@ def _make_circular(seg: rt.WaySegment, start_points, end_points) -> rt.SplitSegm
                 split_idx = i
                 break
         else:
-            mp = shapely.MultiPoint(end_points)
+            mp = shapely.MultiPoint(list(end_points))
             dist, split_idx = min((shapely.distance(mp, shapely.Point(way.first)), i)
                                   for i, way in enumerate(seg.ways) if i > 0)
     elif seg.first in end_points and start_points:
@@ -339,7 +337,7 @@ def _make_circular(seg: rt.WaySegment, start_points, end_points) -> rt.SplitSegm
                 split_idx = i
                 break
         else:
-            mp = shapely.MultiPoint(start_points)
+            mp = shapely.MultiPoint(list(start_points))
             dist, split_idx = min((shapely.distance(mp, shapely.Point(way.first)), i)
                                   for i, way in enumerate(seg.ways) if i > 0)
     else:
@@ -573,37 +571,66 @@ def _make_linear(segments: list[rt.AnySegment]) -> tuple[list[rt.AnySegment], st
 
     assert len(segments) == sum(len(s) for s in sublists)
 
+    index = _EndpointIndex(sublists)
+
     while len(sublists) > 1:
         cur = sublists.pop()
+        index.remove(len(sublists), cur)
         # first try to keep direction
-        for l in sublists:
+        if (pos := index.find(cur[0].first, cur[-1].last)) is not None:
+            l = sublists[pos]
+            index.remove(pos, l)
             if l[-1].last == cur[0].first:
                 l.extend(cur)
-                break
-            if l[0].first == cur[-1].last:
+            else:
                 l[:0] = cur
-                break
-        else:
-            # then try with reversing
-            for l in sublists:
-                if l[-1].last == cur[-1].last:
-                    cur.reverse()
-                    for sub in cur:
-                        sub.reverse()
-                    l.extend(cur)
-                    break
-                if l[0].first == cur[0].first:
-                    cur.reverse()
-                    for sub in cur:
-                        sub.reverse()
-                    l[:0] = cur
-                    break
+            index.add(pos, l)
+        # then try with reversing
+        elif (pos := index.find(cur[-1].last, cur[0].first)) is not None:
+            l = sublists[pos]
+            index.remove(pos, l)
+            append = l[-1].last == cur[-1].last
+            cur.reverse()
+            for sub in cur:
+                sub.reverse()
+            if append:
+                l.extend(cur)
             else:
-                return segments, 'no' # couldn't merge
+                l[:0] = cur
+            index.add(pos, l)
+        else:
+            return segments, 'no' # couldn't merge
 
     assert len(sublists[0]) == len(segments)
     return sublists[0], 'sorted'
 
+class _EndpointIndex:
+    """ Index over the end points of a list of segment lists.
+        Lists are referred to by their position.
+    """
+
+    def __init__(self, seglists: list[list[rt.AnySegment]]) -> None:
+        self.starts = defaultdict(set)
+        self.ends = defaultdict(set)
+        for i, seglist in enumerate(seglists):
+            self.add(i, seglist)
+
+    def add(self, pos: int, seglist: list[rt.AnySegment]) -> None:
+        self.starts[seglist[0].first].add(pos)
+        self.ends[seglist[-1].last].add(pos)
+
+    def remove(self, pos: int, seglist: list[rt.AnySegment]) -> None:
+        self.starts[seglist[0].first].discard(pos)
+        self.ends[seglist[-1].last].discard(pos)
+
+    def find(self, end_pt, start_pt) -> int | None:
+        """ Return the smallest position of a list that either ends
+            in 'end_pt' or starts with 'start_pt'.
+        """
+        candidates = self.ends.get(end_pt, set()) | self.starts.get(start_pt, set())
+        return min(candidates, default=None)
+
+
 def _add_appendix_to_route(route: rt.RouteSegment, segments: list[rt.BaseSegment]) -> None:
     """ Take a list of RouteSegments and WaySegments with the same role
         and create appendixes for the given route.
@@ -5,12 +5,14 @@
 """ Container for a simple OSM way.
 """
 import math
+from copy import copy
 from dataclasses import dataclass
 from collections import abc
 
 from osgende.common.tags import TagStore
+import numpy as np
+import shapely
 from shapely import LineString
-from shapely.geometry import shape
 
 from ..common.json_writer import JsonWriter
 
@@ -33,41 +35,125 @@ def _adjust_start_segment_list(start, start_pt, segments):
     return start
 
 
-@dataclass
 class BaseWay:
     """ Container for a single OSM way.
+
+        The geometry of the way is kept either as a Shapely geometry or
+        as an array of coordinates, never both. A way created from a
+        geometry switches to coordinates once they are needed. Geometries
+        created from coordinates are not cached.
+
+        Reversing the way only flips its orientation. Coordinates and
+        geometry are kept in their original direction and are only
+        presented in reverse order when accessed.
     """
     ROUTE_TYPE = 'base'
 
-    osm_id: int
-    """ OSM Way ID for the segment. """
-    tags: TagStore
-    """ Full set of OSM tags for the way. """
-    length: int
-    """ Length in meters. """
-    direction: int
-    """ Use only Forward: 1, Use only Backward: -1, Bi-directional: 0 """
-    geom: LineString
-    """ Geometry of the way. Must go forward relative to the primary direction
-        of the route."""
-    role: str | None = None
-    """ Optional role of the way within the relation. """
-    start: int | None = None
-    """ Distance from beginning of route.
-        (Either in meter or in number of members in the relation.)
-    """
+    __slots__ = {
+        'osm_id': """ OSM Way ID for the segment. """,
+        'tags': """ Full set of OSM tags for the way. """,
+        'length': """ Length in meters. """,
+        'direction': """ Use only Forward: 1, Use only Backward: -1, Bi-directional: 0 """,
+        'role': """ Optional role of the way within the relation. """,
+        'start': """ Distance from beginning of route.
+                     (Either in meter or in number of members in the relation.)
+                 """,
+        '_coords': """ Coordinates of the way in original orientation
+                       as an array of shape (n, 2).
+                   """,
+        '_geom': """ Shapely geometry of the way in original orientation. """,
+        '_reversed': """ True, if the way is reversed relative to the original. """,
+        '_first': """ Cached first point. """,
+        '_last': """ Cached last point. """
+    }
+
+    def __init__(self, osm_id: int, tags: TagStore, length: int, direction: int,
+                 geom: LineString | None = None, role: str | None = None,
+                 start: int | None = None, *,
+                 coords: np.ndarray | None = None,
+                 endpoints: tuple[tuple[float, float], tuple[float, float]] | None = None
+                 ) -> None:
+        if geom is None and coords is None:
+            raise ValueError("BaseWay needs a geometry or coordinates.")
+        self.osm_id = osm_id
+        self.tags = tags
+        self.length = length
+        self.direction = direction
+        self.role = role
+        self.start = start
+        self._geom = geom
+        self._coords = coords
+        self._reversed = False
+        self._first, self._last = (None, None) if endpoints is None else endpoints
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, BaseWay):
+            return NotImplemented
+
+        return self.osm_id == other.osm_id and self.tags == other.tags \
+               and self.length == other.length and self.direction == other.direction \
+               and self.role == other.role and self.start == other.start \
+               and np.array_equal(self.coords, other.coords)
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"BaseWay(osm_id={self.osm_id!r}, tags={self.tags!r}, "\
+               f"length={self.length!r}, direction={self.direction!r}, "\
+               f"coords={self.coords.tolist()!r}, role={self.role!r}, start={self.start!r})"
+
+    @property
+    def geom(self) -> LineString:
+        """ Geometry of the way. Must go forward relative to the primary direction
+            of the route.
+        """
+        if self._geom is not None and not self._reversed:
+            return self._geom
+
+        return shapely.linestrings(self.coords)
+
+    @geom.setter
+    def geom(self, value: LineString) -> None:
+        self._geom = value
+        self._coords = None
+        self._reversed = False
+        self._first = self._last = None
+
+    @property
+    def coords(self) -> np.ndarray:
+        """ Coordinates of the geometry as an array of shape (n, 2).
+        """
+        if self._coords is None:
+            self._coords = shapely.get_coordinates(self._geom)
+            self._geom = None
+        return self._coords[::-1] if self._reversed else self._coords
+
+    @coords.setter
+    def coords(self, value: np.ndarray) -> None:
+        self._coords = value
+        self._geom = None
+        self._reversed = False
+        self._first = self._last = None
+
+    @property
+    def endpoints(self) -> tuple[tuple[float, float], tuple[float, float]]:
+        return self.first, self.last
 
     @property
     def is_closed(self) -> bool:
-        return self.geom.is_closed
+        return self.first == self.last
 
     @property
     def first(self) -> tuple[float, float]:
-        return self.geom.coords[0]
+        if self._first is None:
+            self._first = tuple(self.coords[0].tolist())
+        return self._first
 
     @property
     def last(self) -> tuple[float, float]:
-        return self.geom.coords[-1]
+        if self._last is None:
+            self._last = tuple(self.coords[-1].tolist())
+        return self._last
 
     def reverse(self) -> None:
         """ Reverse the direction of the way.
@@ -75,7 +161,8 @@ class BaseWay:
             If the way is directional, then the direction will be
             reversed as well.
         """
-        self.geom = self.geom.reverse()
+        self._reversed = not self._reversed
+        self._first, self._last = self._last, self._first
         self.direction = -self.direction
 
     def adjust_start_point(self, start: int) -> None:
@@ -85,8 +172,19 @@ class BaseWay:
         self.start = start
         return start + self.length
 
+    def clone(self) -> 'BaseWay':
+        """ Return a copy of the way that can be modified independently.
+            Tags and geometry are shared with the original.
+        """
+        return copy(self)
+
     def to_json(self) -> str:
-        writer = JsonWriter().start_object()\
+        return self.write_json(JsonWriter())()
+
+    def write_json(self, writer: JsonWriter) -> JsonWriter:
+        """ Write the JSON representation of the way into the given writer.
+        """
+        return writer.start_object()\
                 .keyval('route_type', self.ROUTE_TYPE)\
                 .keyval('start', self.start)\
                 .keyval('id', self.osm_id)\
@@ -96,28 +194,21 @@ class BaseWay:
                 .keyval('role', self.role or '')\
                 .key('geometry').start_object()\
                     .keyval('type', 'LineString')\
-                    .key('coordinates').start_array()
-
-        for c in self.geom.coords:
-            writer.start_array()\
-                .float(c[0], 2).next()\
-                .float(c[1], 2).end_array()\
-                .next()
-
-        writer.end_array().next().end_object().next()\
+                    .key('coordinates')\
+                        .coordinates(self.coords.ravel().tolist(), 2)\
+                        .next()\
+                .end_object().next()\
                 .end_object()
 
-        return writer()
-
     @staticmethod
     def from_json_dict(obj) -> 'BaseWay':
         return BaseWay(osm_id=obj['id'], tags=TagStore(obj['tags']),
                        length=obj['length'], direction=obj['direction'],
-                       geom=shape(obj['geometry']),
+                       coords=np.array(obj['geometry']['coordinates'], dtype=float),
                        role=obj['role'], start=obj['start'])
 
 
-@dataclass
+@dataclass(slots=True)
 class WaySegment:
     """ A segment containing only BaseWays that create a linear section
         of way. The BaseWays must have compatible attributes in terms of
@@ -190,6 +281,12 @@ class WaySegment:
         return False
 
 
+    def clone(self) -> 'WaySegment':
+        """ Return a copy of the segment that can be modified independently.
+        """
+        return WaySegment(length=self.length, start=self.start,
+                          ways=[w.clone() for w in self.ways])
+
     def split_way(self, idx: int) -> 'tuple[WaySegment, WaySegment]':
         """ Split the way into two segments.
         """
@@ -223,12 +320,17 @@ class WaySegment:
         return False
 
     def to_json(self) -> str:
-        return JsonWriter().start_object()\
+        return self.write_json(JsonWriter())()
+
+    def write_json(self, writer: JsonWriter) -> JsonWriter:
+        """ Write the JSON representation of the segment into the given writer.
+        """
+        return writer.start_object()\
                 .keyval('route_type', self.ROUTE_TYPE)\
                 .keyval('start', self.start)\
                 .keyval('length', self.length)\
                 .key('ways').object_array(self.ways).next()\
-                .end_object()()
+                .end_object()
 
     @staticmethod
     def from_json_dict(obj) -> 'WaySegment':
@@ -237,7 +339,7 @@ class WaySegment:
 
 
 
-@dataclass
+@dataclass(slots=True)
 class SplitSegment:
     """ A segment with different routes for forward and backward.
     """
@@ -291,6 +393,14 @@ class SplitSegment:
         self.first = self.forward[0].first
         self.last = self.forward[-1].last
 
+    def clone(self) -> 'SplitSegment':
+        """ Return a copy of the segment that can be modified independently.
+        """
+        return SplitSegment(length=self.length, start=self.start,
+                            first=self.first, last=self.last,
+                            forward=[s.clone() for s in self.forward],
+                            backward=[s.clone() for s in self.backward])
+
     def merge_split(self, other) -> bool:
         """ Try to merge other into this split segment.
             Return true, if that was possible.
@@ -315,7 +425,12 @@ class SplitSegment:
                    for s in (self.backward, self.forward))
 
     def to_json(self) -> str:
-        return JsonWriter().start_object()\
+        return self.write_json(JsonWriter())()
+
+    def write_json(self, writer: JsonWriter) -> JsonWriter:
+        """ Write the JSON representation of the segment into the given writer.
+        """
+        return writer.start_object()\
                 .keyval('route_type', self.ROUTE_TYPE)\
                 .keyval('start', self.start)\
                 .keyval('length', self.length)\
@@ -327,7 +442,7 @@ class SplitSegment:
                     .float(self.last[1], 2).end_array().next()\
                 .key('forward').object_array(self.forward).next()\
                 .key('backward').object_array(self.backward).next()\
-                .end_object()()
+                .end_object()
 
     @staticmethod
     def from_json_dict(obj) -> 'SplitSegment':
@@ -336,7 +451,7 @@ class SplitSegment:
                             forward=obj['forward'], backward=obj['backward'])
 
 
-@dataclass
+@dataclass(slots=True)
 class AppendixSegment:
     """ A linear section that does not belong to the main route. May contain gaps.
     """
@@ -378,15 +493,26 @@ class AppendixSegment:
         """
         return _adjust_start_segment_list(start, self.first, self.main)
 
+    def clone(self) -> 'AppendixSegment':
+        """ Return a copy of the segment that can be modified independently.
+        """
+        return AppendixSegment(length=self.length, start=self.start, end=self.end,
+                               main=[s.clone() for s in self.main])
+
     def to_json(self) -> str:
-        return JsonWriter().start_object()\
+        return self.write_json(JsonWriter())()
+
+    def write_json(self, writer: JsonWriter) -> JsonWriter:
+        """ Write the JSON representation of the segment into the given writer.
+        """
+        return writer.start_object()\
                 .keyval('route_type', self.ROUTE_TYPE)\
                 .keyval('role', self.role)\
                 .keyval_not_none('start', self.start)\
                 .keyval_not_none('end', self.end)\
                 .keyval('length', self.length)\
                 .key('main').object_array(self.main).next()\
-                .end_object()()
+                .end_object()
 
     @staticmethod
     def from_json_dict(obj) -> 'AppendixSegment':
@@ -447,6 +573,17 @@ class RouteSegment:
             s.reverse()
         # XXX effect on appendices?
 
+    def clone(self) -> 'RouteSegment':
+        """ Return a copy of the route that can be modified independently.
+            Only the tree structure is copied, tags and geometries of
+            the ways are shared with the original.
+        """
+        return RouteSegment(length=self.length, linear=self.linear,
+                            main=[s.clone() for s in self.main],
+                            appendices=[s.clone() for s in self.appendices],
+                            direction=self.direction, role=self.role,
+                            start=self.start, id=self.id)
+
     def get_linear_state(self) -> str:
         """ Return the linear state of the complete route.
             This function also checks the state of subroutes and
@@ -484,7 +621,12 @@ class RouteSegment:
         return end
 
     def to_json(self) -> str:
-        return JsonWriter().start_object()\
+        return self.write_json(JsonWriter())()
+
+    def write_json(self, writer: JsonWriter) -> JsonWriter:
+        """ Write the JSON representation of the route into the given writer.
+        """
+        return writer.start_object()\
                 .keyval('route_type', self.ROUTE_TYPE)\
                 .keyval('length', self.length)\
                 .keyval('linear' , self.linear)\
@@ -493,7 +635,7 @@ class RouteSegment:
                 .keyval_not_none('id', self.id)\
                 .key('main').object_array(self.main).next()\
                 .key('appendices').object_array(self.appendices).next()\
-                .end_object()()
+                .end_object()
 
     @staticmethod
     def from_json_dict(obj) -> 'RouteSegment':
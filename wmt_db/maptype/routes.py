@@ -13,10 +13,10 @@ import osgende
 from osgende.generic import FilteredTable
 from osgende.lines import RelationWayTable, SegmentsTable
 from osgende.relations import RelationHierarchy
-from osgende.common.tags import TagStore
 from wmt_shields import ShieldFactory
 
 from wmt_db.common.route_types import Network
+from ..common.shield_render import ShieldRenderer
 from ..tables.countries import CountryGrid
 from ..tables.routes import Routes
 from ..tables.guideposts import GuidePosts
@@ -52,19 +52,15 @@ class RouteMapDB(osgende.MapDB):
         sel = sa.select(rel.c.tags, route.data.c.country, route.data.c.level)\
                 .where(rel.c.id == route.data.c.id)
 
-        donesyms = set()
-
         with self.engine.begin() as conn:
-            for r in conn.execution_options(stream_results=True).execute(sel):
-                sym = route.symbols.create(TagStore(r.tags), r.country,
-                                           style=Network.from_int(r.level).name)
+            total = conn.scalar(sa.select(sa.func.count()).select_from(route.data))
+            renderer = ShieldRenderer(route.symbols, self.site_config,
+                                      self.get_option('numprocesses', 0), total)
 
-                if sym is not None:
-                    symid = sym.uuid()
+            for r in conn.execution_options(stream_results=True).execute(sel):
+                renderer.add(r.tags, r.country, style=Network.from_int(r.level).name)
 
-                    if symid not in donesyms:
-                        donesyms.add(symid)
-                        sym.to_file(self.site_config.ROUTES.symbol_datadir / f'{symid}.svg', format='svg')
+        renderer.finish()
 
 
 def create_mapdb(site_config, options):
@@ -91,6 +87,12 @@ def setup_tables(db, route_class=Routes):
 
     db.set_metadata('srid', db.site_config.DB_SRID)
     db.set_metadata('num_threads', db.get_option('numthreads'))
+    db.set_metadata('batch_size', db.get_option('batch_size'))
+    db.set_metadata('num_processes', db.get_option('numprocesses'))
+    db.set_metadata('country_index', db.get_option('country_index', False))
+    db.set_metadata('preload_shields', db.get_option('preload_shields', False))
+    db.set_metadata('preload_routes', db.get_option('preload_routes', False))
+    db.set_metadata('sql_style', db.get_option('sql_style', False))
 
     tabname = db.site_config.DB_TABLES
 
@@ -12,7 +12,8 @@ from osgende.generic import FilteredTable
 from osgende.common.tags import TagStore
 from osgende.lines import GroupedWayTable
 
-from ..tables.piste import PisteRoutes, PisteWayInfo
+from ..tables.piste import PisteRoutes, PisteWayInfo, basic_tag_transform
+from ..common.shield_render import ShieldRenderer
 from ..maptype.routes import setup_tables
 
 class SlopesMapDB(osgende.MapDB):
@@ -39,27 +40,24 @@ class SlopesMapDB(osgende.MapDB):
         rel = self.osmdata.relation.data
         way = self.osmdata.way.data
 
-        donesyms = set()
-        self._write_shields(route,
-                            sa.select(rel.c.tags).where(rel.c.id == route.data.c.id),
-                            donesyms)
-        self._write_shields(sway,
-                            sa.select(way.c.tags).where(way.c.id == sway.data.c.id),
-                            donesyms)
-
-    def _write_shields(self, source, subset, donesyms):
+        with self.engine.begin() as conn:
+            total = conn.scalar(sa.select(sa.func.count()).select_from(route.data)) \
+                    + conn.scalar(sa.select(sa.func.count()).select_from(sway.data))
+
+        renderer = ShieldRenderer(route.shield_fab, self.site_config,
+                                  self.get_option('numprocesses', 0), total)
+        self._write_shields(renderer,
+                            sa.select(rel.c.tags).where(rel.c.id == route.data.c.id))
+        self._write_shields(renderer,
+                            sa.select(way.c.tags).where(way.c.id == sway.data.c.id))
+        renderer.finish()
+
+    def _write_shields(self, renderer, subset):
         with self.engine.begin() as conn:
             for r in conn.execution_options(stream_results=True).execute(subset):
-                tags = TagStore(r.tags)
-                _, difficulty = self.tables.routes.basic_tag_transform(0, tags)
-                sym = source.symbols.create(tags, '', difficulty)
-
-                if sym is not None:
-                    symid = sym.get_id()
-
-                    if symid not in donesyms:
-                        donesyms.add(symid)
-                        source.symbols.write(sym, True)
+                difficulty = basic_tag_transform(TagStore(r.tags),
+                                                 self.site_config.ROUTES)['difficulty']
+                renderer.add(r.tags, '', difficulty=difficulty)
 
 
 def create_mapdb(site_config, options):
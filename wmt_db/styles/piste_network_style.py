@@ -10,6 +10,8 @@ from ..common.route_types import Network
 
 class PisteNetworkStyle(object):
     table_name = 'piste_style'
+    # columns of the route table needed in add_to_collector()
+    route_columns = ('id', 'top', 'difficulty', 'piste', 'symbol')
 
     def __init__(self, difficulties, types):
         self.difficulty_map = difficulties
@@ -16,12 +16,17 @@
 # Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
 
 import sqlalchemy as sa
-from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.dialects.postgresql import ARRAY, aggregate_order_by
 
 from ..common.route_types import Network
 
 class RouteNetworkStyle:
     table_name = 'network_style'
+    # columns of the route table needed in add_to_collector()
+    route_columns = ('id', 'top', 'network', 'level', 'symbol', 'country')
+    # Function that returns an SQL condition over the route table for
+    # routes that a replaced add_to_collector() handles differently.
+    custom_routes = None
 
     def add_columns(self, table):
         table.append_column(sa.Column('class', sa.Integer))
@@ -55,11 +60,75 @@ class RouteNetworkStyle:
             c['cldrels'].append(relinfo.id)
 
     def to_columns(self, c):
-        c['lshields'] = list(c['lshields'])[:5] if c['lshields'] else None
-        c['inrshields'] = list(c['inrshields'])[:5] if c['inrshields'] else None
+        # Sort the shields, so that always the same ones are kept.
+        c['lshields'] = sorted(c['lshields'])[:5] if c['lshields'] else None
+        c['inrshields'] = sorted(c['inrshields'])[:5] if c['inrshields'] else None
 
         return c
 
+    def construct_sql(self, segments, routes):
+        """ Return a query that computes the style columns for all
+            segments in the database. 'segments' must be a subquery with
+            the segment id and the array of relations. 'routes' is the
+            route table.
+
+            The query implements add_to_collector() and to_columns(). When
+            one of the collector functions has been replaced, segments with
+            routes matching 'custom_routes' are left out and need to be
+            computed in Python. Without 'custom_routes' nothing can be
+            computed in SQL and None is returned.
+        """
+        replaced = 'add_to_collector' in self.__dict__ \
+                   or 'add_shield_to_collector' in self.__dict__
+        if replaced and self.custom_routes is None:
+            return None
+
+        rels = sa.func.unnest(segments.c.rels)\
+                 .table_valued('rel', with_ordinality='ord')\
+                 .render_derived().lateral()
+        r = routes
+
+        top = r.c.top.is_(True)
+        styled = sa.and_(top, sa.or_(r.c.network == None, r.c.network != 'NDS'))
+        shield = sa.and_(styled, r.c.symbol != None)
+        empty = sa.cast(sa.literal_column("'{}'"), ARRAY(sa.BigInteger))
+
+        # Sort in binary order like the sorting in Python.
+        symbol = r.c.symbol.collate('C')
+
+        def _shields(where):
+            return sa.func.array_agg(aggregate_order_by(sa.distinct(symbol), symbol),
+                                     type_=ARRAY(sa.String))\
+                     .filter(sa.and_(shield, where))[1:5]
+
+        def _rels(where):
+            return sa.func.coalesce(
+                       sa.func.array_agg(aggregate_order_by(rels.c.rel, rels.c.ord),
+                                         type_=ARRAY(sa.BigInteger))
+                         .filter(where),
+                       empty)
+
+        sql = sa.select(
+                 segments.c.id,
+                 sa.func.coalesce(sa.func.bit_or(sa.literal(1).op('<<')(r.c.level))
+                                    .filter(styled), 0).label('class'),
+                 sa.func.array_agg(aggregate_order_by(r.c.network, rels.c.ord.desc()),
+                                   type_=ARRAY(sa.String))
+                   .filter(sa.and_(top, r.c.network != None))[1].label('style'),
+                 _shields(r.c.level > Network.LOC.max()).label('inrshields'),
+                 _shields(r.c.level <= Network.LOC.max()).label('lshields'),
+                 _rels(top).label('toprels'),
+                 _rels(sa.and_(r.c.id != None, r.c.top.is_not(True))).label('cldrels'))\
+               .select_from(segments.outerjoin(rels, sa.true())
+                                    .outerjoin(r, r.c.id == rels.c.rel))\
+               .group_by(segments.c.id)
+
+        if replaced:
+            sql = sql.having(sa.not_(sa.func.coalesce(
+                                 sa.func.bool_or(self.custom_routes(r)), sa.false())))
+
+        return sql
+
     def add_shield_to_collector(self, c, relinfo):
         if relinfo.symbol  is None:
             return
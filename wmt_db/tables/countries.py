@@ -5,7 +5,9 @@
 """ Tables for administrative structures
 """
 import sqlalchemy as sa
+import shapely
 from geoalchemy2 import Geometry
+from geoalchemy2.shape import to_shape
 
 class CountryGrid:
     """Wraps a Nominatim country_osm_grid table.
@@ -17,6 +19,7 @@ class CountryGrid:
                              sa.Column('area', sa.Float),
                              sa.Column('geom', Geometry)
                             )
+        self.index = None
 
     def column_cc(self):
         """ Returns the column with the country code.
@@ -27,3 +30,41 @@ class CountryGrid:
         """ Returns the column with the geometry.
         """
         return self.data.c.geom
+
+    def load_index(self, conn):
+        """ Load the complete grid into an in-memory index, so that
+            countries can be looked up without querying the database.
+        """
+        if self.index is None:
+            self.index = CountryIndex(conn.execute(sa.select(self.column_cc(),
+                                                             self.column_geom())))
+
+    def find_country(self, geom):
+        """ Return the country code of a country the given Shapely
+            geometry intersects with or None if it is in no country.
+            Needs a previous call to load_index().
+        """
+        return self.index.find(geom)
+
+
+class CountryIndex:
+    """ In-memory spatial index over the country grid.
+    """
+
+    def __init__(self, rows):
+        self.codes = []
+        geoms = []
+        for row in rows:
+            self.codes.append(row.country_code)
+            geoms.append(to_shape(row.geom))
+
+        self.tree = shapely.STRtree(geoms)
+
+    def find(self, geom):
+        """ Return the country code for the given Shapely geometry.
+            When the geometry intersects with multiple countries, then
+            the one that was loaded first is returned.
+        """
+        result = self.tree.query(geom, predicate='intersects')
+
+        return self.codes[min(result)] if len(result) else None
@@ -12,6 +12,7 @@ import sqlalchemy as sa
 from sqlalchemy.sql import functions as saf
 from sqlalchemy.dialects.postgresql import JSONB
 from geoalchemy2 import Geometry
+from geoalchemy2.shape import from_shape
 
 from osgende.common.table import TableSource
 from osgende.common.sqlalchemy import DropIndexIfExists, CreateTableAs
@@ -19,9 +20,9 @@ from osgende.common.threads import ThreadableDBObject
 from osgende.common.tags import TagStore
 from osgende.lines import PlainWayTable
 
-from ..common.data_transforms import make_geometry
-from ..geometry.route_builder import build_route
-from ..geometry.member_loader import get_relation_objects
+from ..common.shield_cache import ShieldCache
+from ..geometry.member_loader import load_member_data
+from ..geometry.assembly import assemble_route
 
 def _add_piste_columns(table, name):
     table.append_column(sa.Column('name', sa.String))
@@ -33,14 +34,8 @@ def _add_piste_columns(table, name):
     table.append_column(sa.Column('tags', JSONB))
     table.append_column(sa.Index(f'idx_{name}_iname', sa.text('upper(name)')))
 
-def write_symbol(factory, tags, difficulty, datadir):
-    sym = factory.create(tags, '', difficulty=difficulty)
-    if sym is None:
-        return 'None'
-
-    symname = sym.uuid()
-    sym.to_file(datadir / f'{symname}.svg', format='svg')
-    return symname
+def write_symbol(factory, tags, difficulty, shield_cache):
+    return shield_cache.write(factory.create(tags, '', difficulty=difficulty))
 
 
 def basic_tag_transform(tags: TagStore, config):
@@ -70,6 +65,7 @@ class PisteRoutes(ThreadableDBObject, TableSource):
         table.append_column(sa.Column('top', sa.Boolean))
         _add_piste_columns(table, config.table_name)
         table.append_column(sa.Column('route', sa.String))
+        table.append_column(sa.Column('route_data', sa.LargeBinary))
         table.append_column(sa.Column('linear', sa.String))
         table.append_column(sa.Column('geom', Geometry('GEOMETRY', srid=ways.srid)))
         table.append_column(sa.Column('render_geom', Geometry('GEOMETRY', srid=ways.srid)))
@@ -84,6 +80,8 @@ class PisteRoutes(ThreadableDBObject, TableSource):
         self.countries = countries
 
         self.shield_fab = shield_factory
+        self.shield_cache = ShieldCache(config.symbol_datadir,
+                                        meta.info.get('preload_shields', False))
 
 
     def _insert_objects(self, engine, subsel=None):
@@ -141,6 +139,7 @@ class PisteRoutes(ThreadableDBObject, TableSource):
                  .where(self.rels.c.id.notin_(
                      sa.select(h.c.child).distinct().scalar_subquery()))
         self.insert_objects(engine, subset)
+        self.shield_cache.clear()
 
         idx.create(engine)
 
@@ -169,6 +168,7 @@ class PisteRoutes(ThreadableDBObject, TableSource):
 
         # and insert/update all
         self._insert_objects(engine, self.rels.c.id.in_(tmp_rels.select()))
+        self.shield_cache.clear()
 
         with engine.begin() as conn:
             tmp_rels.drop(conn)
@@ -197,23 +197,25 @@ class PisteRoutes(ThreadableDBObject, TableSource):
         # we don't support hierarchy at the moment
         outtags['top'] = True
 
-        # geometry
-        geom, render_geom = make_geometry(conn, obj.members, self.ways, self.data)
+        # geometry and route
+        member_data = load_member_data(conn, obj.members, self.ways, self.data,
+                                       with_geometry=True)
+        route_info = assemble_route(obj.members, member_data)
 
-        if geom is None:
+        if route_info is None:
             return None
 
-        route_members = get_relation_objects(conn, obj.members, self.ways, self.data)
-        assert len(route_members) > 0
-        route = build_route(route_members)
+        geom, render_geom, route_json, route_data, linear = route_info
 
-        outtags['geom'] = geom
-        outtags['render_geom'] = render_geom
-        outtags['route'] = route.to_json()
-        outtags['linear'] = route.get_linear_state()
+        srid = self.c.geom.type.srid
+        outtags['geom'] = from_shape(geom, srid=srid)
+        outtags['render_geom'] = from_shape(render_geom, srid=srid)
+        outtags['route'] = route_json
+        outtags['route_data'] = route_data
+        outtags['linear'] = linear
         outtags['symbol'] = write_symbol(self.shield_fab, tags,
                                          outtags['difficulty'],
-                                         self.config.symbol_datadir)
+                                         self.shield_cache)
         outtags['id'] = obj.id
 
         return outtags
@@ -225,11 +227,21 @@ class PisteWayInfo(PlainWayTable):
         super().__init__(meta, name, source, osmdata)
         self.config = config
         self.shield_fab = shield_factory
+        self.shield_cache = ShieldCache(config.symbol_datadir,
+                                        meta.info.get('preload_shields', False))
         self.uptable = uptable
 
     def add_columns(self, dest, src):
         _add_piste_columns(dest, 'piste_way_info')
 
+    def construct(self, engine):
+        super().construct(engine)
+        self.shield_cache.clear()
+
+    def update(self, engine):
+        super().update(engine)
+        self.shield_cache.clear()
+
     def before_update(self, engine):
         # save all old geometries that will be deleted
         sql = sa.select(self.c.geom)\
@@ -248,6 +260,6 @@ class PisteWayInfo(PlainWayTable):
         outtags = basic_tag_transform(tags, self.config)
         outtags['symbol'] = write_symbol(self.shield_fab, tags,
                                          outtags['difficulty'],
-                                         self.config.symbol_datadir)
+                                         self.shield_cache)
 
         return outtags
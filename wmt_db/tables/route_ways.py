@@ -4,12 +4,22 @@
 # Copyright (C) 2024 Sarah Hoffmann
 
 import sqlalchemy as sa
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import JSONB, ARRAY, array
+from geoalchemy2 import Geography
 import shapely.geometry as sgeom
 
 from osgende.lines import RelationWayTable
+from osgende.common.sqlalchemy import DropIndexIfExists
 
 class RouteWayTable(RelationWayTable):
+    """ Table of ways that are part of a route relation.
+
+        The table keeps the geodesic length of each way in meters and
+        the coordinates of its first and last point as an array
+        [x0, y0, x1, y1]. They are computed at the end of construction
+        and recomputed during updates for all ways that have changed,
+        either in their tags or in their geometry.
+    """
 
     def make_geometry(self, points):
         if len(points) <= 1:
@@ -21,6 +31,45 @@ class RouteWayTable(RelationWayTable):
 
     def add_columns(self, table):
         table.append_column(sa.Column('tags', JSONB))
+        table.append_column(sa.Column('length', sa.Integer))
+        table.append_column(sa.Column('endpoints', ARRAY(sa.Float)))
 
     def transform_tags(self, oid, tags):
-        return {'tags': tags}
+        return {'tags': tags, 'length': None, 'endpoints': None}
+
+    def construct(self, engine):
+        super().construct(engine)
+        self.compute_way_info(engine)
+
+        idx = sa.Index(f'idx_{self.data.name}_missing_length', self.c.id,
+                       postgresql_where=self.c.length.is_(None))
+        with engine.begin() as conn:
+            conn.execute(DropIndexIfExists(idx))
+        idx.create(engine)
+
+    def update(self, engine):
+        super().update(engine)
+        # The geometry of a way may change without a change of its tags,
+        # so recompute the information for all changed ways.
+        self.compute_way_info(engine, self.c.id.in_(self.select_add_modify()))
+
+    def compute_way_info(self, engine, subset=None):
+        """ Compute length and end points for all ways where they are
+            missing and for all ways selected by the optional 'subset'.
+        """
+        t = self.data
+        length = sa.func.ST_Length(sa.func.ST_Transform(t.c.geom, 4326).cast(Geography))
+        first = sa.func.ST_StartPoint(t.c.geom)
+        last = sa.func.ST_EndPoint(t.c.geom)
+
+        todo = t.c.length.is_(None)
+        if subset is not None:
+            todo = sa.or_(todo, subset)
+
+        with engine.begin() as conn:
+            conn.execute(t.update()
+                          .where(todo)
+                          .where(t.c.geom.is_not(None))
+                          .values(length=sa.func.floor(length),
+                                  endpoints=array([sa.func.ST_X(first), sa.func.ST_Y(first),
+                                                   sa.func.ST_X(last), sa.func.ST_Y(last)])))
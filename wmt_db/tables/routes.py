@@ -4,12 +4,17 @@
 # Copyright (C) 2023 Sarah Hoffmann
 
 import dataclasses
-from typing import Dict, List, Union
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+import threading
+from typing import Dict, List, Set, Union
 
 import sqlalchemy as sa
 from sqlalchemy.sql import functions as saf
 from sqlalchemy.dialects.postgresql import JSONB, ARRAY
 from geoalchemy2 import Geometry
+from geoalchemy2.shape import from_shape
 
 from osgende.common.table import TableSource
 from osgende.common.sqlalchemy import DropIndexIfExists, CreateTableAs
@@ -17,9 +22,12 @@ from osgende.common.threads import ThreadableDBObject
 from osgende.common.tags import TagStore
 
 from ..common.route_types import Network
-from ..common.data_transforms import make_itinerary, make_geometry
-from ..geometry.route_builder import build_route
-from ..geometry.member_loader import get_relation_objects
+from ..common.data_transforms import make_itinerary
+from ..common.copy_writer import CopyWriter
+from ..common.scheduler import HierarchyScheduler
+from ..common.shield_cache import ShieldCache
+from ..geometry.member_loader import load_member_data
+from ..geometry.assembly import assemble_route, patch_route, select_member_data
 
 @dataclasses.dataclass
 class RouteRow:
@@ -36,10 +44,24 @@ class RouteRow:
     rel_members: Union[None, List[int]] = None
 
 
+@dataclasses.dataclass
+class RouteChanges:
+    """ Summary of the changes that triggered an update of the routes.
+    """
+    changed_ways: Set[int]
+    """ Route ways that were added or modified. """
+    modified_rels: Set[int]
+    """ Relations that were added or modified themselves. """
+    update_rels: Set[int]
+    """ All relations that are going to be updated. """
+
+
 class Routes(ThreadableDBObject, TableSource):
     """ Table that creates information about the routes. This includes
         general information as well as the geometry.
     """
+    # Number of rows a worker thread collects before sending them with COPY.
+    copy_rows = 500
 
     def __init__(self, meta, relations, ways, hierarchy, countries, config,
                  shield_factory):
@@ -58,6 +80,7 @@ class Routes(ThreadableDBObject, TableSource):
                          sa.Column('rel_members', ARRAY(sa.BigInteger)),
                          sa.Column('tags', JSONB),
                          sa.Column('route', sa.String),
+                         sa.Column('route_data', sa.LargeBinary),
                          sa.Column('linear', sa.String),
                          sa.Column('geom', Geometry('GEOMETRY', srid=ways.srid)),
                          sa.Column('render_geom', Geometry('GEOMETRY', srid=ways.srid,
@@ -73,8 +96,19 @@ class Routes(ThreadableDBObject, TableSource):
         self.countries = countries
 
         self.symbols = shield_factory
+        self.shield_cache = ShieldCache(config.symbol_datadir,
+                                        meta.info.get('preload_shields', False))
 
         self.numthreads = meta.info.get('num_threads', 1)
+        self.batch_size = meta.info.get('batch_size') or 1
+        self.num_processes = meta.info.get('num_processes') or 0
+        self.use_country_index = meta.info.get('country_index', False)
+        self.parent_networks = {}
+        self.child_rels = set()
+        self.pool = None
+        self.changes = None
+        self.copy_writer = None
+        self.copy_buffers = {}
 
     def _compute_route_level(self, network):
         # Multi-modal routes might have multiple network tags
@@ -85,33 +119,77 @@ class Routes(ThreadableDBObject, TableSource):
         return Network.LOC()
 
 
+    @contextmanager
+    def _process_pool(self):
+        """ Set up the pool of worker processes for route assembly,
+            if requested.
+        """
+        if self.num_processes > 0:
+            ctx = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=self.num_processes,
+                                     mp_context=ctx) as pool:
+                self.pool = pool
+                try:
+                    yield
+                finally:
+                    self.pool = None
+        else:
+            yield
+
     def _insert_objects(self, engine, subsel=None):
         h = self.rtree.data
+        rel_ids = sa.select(self.rels.c.id)
+        if subsel is not None:
+            rel_ids = rel_ids.where(subsel)
+
+        # Relations are processed as soon as all their child relations
+        # are done. This guarantees that the geometry of member relations
+        # is already available for processing the relation geometry.
+        # Only dependencies between relations that are processed here
+        # are of interest.
+        edges = sa.select(h.c.parent, h.c.child).distinct()\
+                  .where(h.c.depth == 2)\
+                  .where(h.c.parent.in_(rel_ids))\
+                  .where(h.c.child.in_(rel_ids))
+        levels = sa.select(h.c.child, saf.max(h.c.depth).label("lvl"))\
+                   .group_by(h.c.child)
+        # Networks of the direct parents, needed to compute the top flag.
+        r = self.rels.data
+        networks = sa.select(h.c.child, r.c.tags['network'].astext.label('network'))\
+                     .distinct()\
+                     .where(h.c.depth == 2)\
+                     .where(r.c.id == h.c.parent)\
+                     .where(r.c.tags.has_key('network'))
+        if subsel is not None:
+            levels = levels.where(h.c.child.in_(rel_ids))
+            networks = networks.where(h.c.child.in_(rel_ids))
+
+        scheduler = HierarchyScheduler(self.batch_size,
+                                       4 * max(self.numthreads or 1, 1))
         with engine.begin() as conn:
-            max_depth = conn.scalar(sa.select(saf.max(h.c.depth)))
-
-        subtab = sa.select(h.c.child, saf.max(h.c.depth).label("lvl"))\
-                   .group_by(h.c.child).alias()
-
-        # Process relations by hierarchy, starting with the highest depth.
-        # This guarantees that the geometry of member relations is already
-        # available for processing the relation geometry.
-        if max_depth is not None:
-            for level in range(max_depth, 1, -1):
-                subset = self.rels.data.select()\
-                          .where(subtab.c.lvl == level)\
-                          .where(self.rels.c.id == subtab.c.child)
-                if subsel is not None:
-                    subset = subset.where(subsel)
-                self.insert_objects(engine, subset)
-
-        # Lastly, process all routes that are nobody's child.
-        subset = self.rels.data.select()\
-                 .where(self.rels.c.id.notin_(
-                     sa.select(h.c.child).distinct().scalar_subquery()))
+            if self.use_country_index:
+                self.countries.load_index(conn)
+            self.child_rels = set()
+            for parent, child in conn.execute(edges):
+                scheduler.add_dependency(parent, child)
+                self.child_rels.add(child)
+            for child, lvl in conn.execute(levels):
+                scheduler.set_level(child, lvl)
+            self.parent_networks = {}
+            for child, network in conn.execute(networks):
+                self.parent_networks.setdefault(child, set()).add(network)
+
+        subset = self.rels.data.select()
         if subsel is not None:
             subset = subset.where(subsel)
-        self.insert_objects(engine, subset)
+
+        with self._process_pool():
+            self.insert_objects(engine, subset, scheduler)
+
+        self.parent_networks = {}
+        self.child_rels = set()
+        self.shield_cache.clear()
+        scheduler.log_statistics()
 
 
     def construct(self, engine):
@@ -131,7 +209,19 @@ class Routes(ThreadableDBObject, TableSource):
                 conn.execute(DropIndexIfExists(idx))
             self.truncate(conn)
 
-        self._insert_objects(engine)
+        # The table is empty, so rows can be bulk-loaded without conflict
+        # handling. Only child relations need to be written with upserts
+        # because their parents read them back during processing.
+        self.copy_writer = CopyWriter(self.data, engine.dialect)
+        try:
+            self._insert_objects(engine)
+            # write out what is left in the buffers of the worker threads
+            with engine.begin() as conn:
+                for lines in self.copy_buffers.values():
+                    self.copy_writer.copy(conn, lines)
+        finally:
+            self.copy_writer = None
+            self.copy_buffers = {}
 
         for idx in indexes:
             idx.create(engine)
@@ -175,31 +265,137 @@ class Routes(ThreadableDBObject, TableSource):
             if free_rels:
                 conn.execute(tmp_rels.insert().values([{'id': x} for x in free_rels]))
 
+            # Relations where only some member ways have changed can be
+            # patched instead of being rebuilt, see _assemble_route().
+            self.changes = RouteChanges(
+                changed_ways=set(conn.scalars(w.select_add_modify())),
+                modified_rels=set(conn.scalars(sa.select(self.rels.cc.id))),
+                update_rels=set(conn.scalars(sa.select(tmp_rels.c.id))))
+
         # and insert/update all
-        self._insert_objects(engine, self.rels.c.id.in_(tmp_rels.select().distinct()))
+        try:
+            self._insert_objects(engine, self.rels.c.id.in_(tmp_rels.select().distinct()))
+        finally:
+            self.changes = None
 
         with engine.begin() as conn:
             tmp_rels.drop(conn)
 
-    def insert_objects(self, engine, subset):
-        workers = self.create_worker_queue(engine, self._process_construct_next)
+    def insert_objects(self, engine, subset, scheduler=None):
+        """ Process all relations selected by 'subset'. The optional
+            scheduler keeps back relations until their children are done.
+
+            Every task is committed on its own, so that the results are
+            immediately visible to the tasks processing the parent relations.
+        """
+        if scheduler is None:
+            scheduler = HierarchyScheduler(self.batch_size,
+                                           4 * max(self.numthreads or 1, 1))
 
-        with engine.execution_options(stream_results=True).begin() as conn:
-            for obj in conn.execute(subset):
-                workers.add_task(obj)
+        self.thread = threading.local()
 
-        workers.finish()
+        with ThreadPoolExecutor(max_workers=max(self.numthreads or 1, 1)) as executor:
+            scheduler.start(lambda objs: executor.submit(self._process_task, engine, objs))
+            with engine.execution_options(stream_results=True).begin() as conn:
+                for obj in conn.execute(subset):
+                    scheduler.add(obj)
+            scheduler.finish()
 
 
+    def _process_task(self, engine, objs):
+        with engine.begin() as conn:
+            self.thread.conn = conn
+            if len(objs) > 1:
+                self._process_construct_batch(objs)
+            else:
+                self._process_construct_next(objs[0])
+
+
+    def _use_copy(self, oid):
+        """ Check if the row for the given relation may be bulk-loaded.
+            Rows written with COPY are buffered and only become visible
+            some time later, so this is not possible for rows that are read by other relations.
+        """
+        return self.copy_writer is not None and oid not in self.child_rels
+
+    def _copy_row(self, cols):
+        # Rows are collected per thread and sent with the connection
+        # of the current task once 'copy_rows' rows are together.
+        lines = self.copy_buffers.setdefault(threading.get_ident(), [])
+        lines.append(self.copy_writer.encode(cols))
+        if len(lines) >= self.copy_rows:
+            self.copy_writer.copy(self.thread.conn, lines)
+            lines.clear()
+
     def _process_construct_next(self, obj):
         cols = self._construct_row(obj, self.thread.conn)
 
         if cols is not None:
-            sql = self.upsert_data().values(cols)
-            self.thread.conn.execute(sql)
+            if self._use_copy(obj.id):
+                self._copy_row(cols)
+            else:
+                self.thread.conn.execute(self.upsert_data().values(cols))
         else:
             self.thread.conn.execute(self.data.delete().where(self.c.id == obj.id))
 
+    def _process_construct_batch(self, objs):
+        """ Process a list of relations at once. The member data for all
+            relations is loaded with a single query per member type and
+            the results are written with a single upsert statement, unless
+            they can be bulk-loaded.
+        """
+        conn = self.thread.conn
+        member_data = load_member_data(conn, [m for o in objs for m in o.members],
+                                       self.ways, self.data, with_geometry=True)
+
+        rows = []
+        deleted = []
+        for obj in objs:
+            cols = self._construct_row(obj, conn, member_data)
+            if cols is None:
+                deleted.append(obj.id)
+            elif self._use_copy(obj.id):
+                self._copy_row(cols)
+            else:
+                rows.append(cols)
+
+        if rows:
+            conn.execute(self.upsert_data().values(rows))
+        if deleted:
+            conn.execute(self.data.delete().where(self.c.id.in_(deleted)))
+
+    def _assemble_route(self, oid, members, relids, member_data):
+        """ Create route and geometries of a relation. During updates,
+            the previous route is patched, when only member ways have changed.
+        """
+        route_info = None
+        changes = self.changes
+        if changes is not None and oid not in changes.modified_rels \
+           and changes.update_rels.isdisjoint(relids):
+            old_route = self.thread.conn.scalar(sa.select(self.c.route_data)
+                                                  .where(self.c.id == oid))
+            if old_route is not None:
+                changed = {m['id'] for m in members if m['type'] == 'W'}\
+                          & changes.changed_ways
+                route_info = self._run_assembly(patch_route, members, member_data,
+                                                route_data=bytes(old_route),
+                                                changed_ways=changed)
+
+        if route_info is None:
+            route_info = self._run_assembly(assemble_route, members, member_data)
+
+        return route_info
+
+    def _run_assembly(self, func, members, member_data, **kwargs):
+        # The route assembly is pure Python. Run it in a separate
+        # process if possible, so that the threads do not fight over the GIL.
+        if self.pool is None:
+            return func(members=members, member_data=member_data, **kwargs)
+
+        return self.pool.submit(func, members=members,
+                                member_data=select_member_data(members, member_data),
+                                **kwargs).result()
+
     def _filter_members(self, oid, members):
         """ Extract relation members and checks and breaks relation
             member cycles.
@@ -226,23 +422,19 @@ class Routes(ThreadableDBObject, TableSource):
         return members, relids
 
     def _write_symbol(self, tags, country, style):
-        sym = self.symbols.create(tags, country, style=style)
-        if sym is None:
-            return 'None'
-
-        uid = sym.uuid()
-        sym.to_file(self.config.symbol_datadir / f'{uid}.svg', format='svg')
-
-        return uid
+        return self.shield_cache.write(self.symbols.create(tags, country, style=style))
 
     def _find_country(self, relids, geom):
         if relids:
             sel = sa.select(self.c.country).distinct()\
                     .where(self.c.id.in_(relids))
+        elif self.use_country_index:
+            return self.countries.find_country(geom)
         else:
             c = self.countries
             sel = sa.select(c.column_cc()).distinct()\
-                    .where(c.column_geom().ST_Intersects(geom))
+                    .where(c.column_geom().ST_Intersects(
+                               from_shape(geom, srid=self.c.geom.type.srid)))
 
         cur = self.thread.conn.execute(sel)
 
@@ -253,7 +445,7 @@ class Routes(ThreadableDBObject, TableSource):
         return None
 
 
-    def _construct_row(self, obj, conn):
+    def _construct_row(self, obj, conn, member_data=None):
         tags = TagStore(obj.tags)
         is_node_network = tags.get('network:type') == 'node_network'
 
@@ -278,15 +470,17 @@ class Routes(ThreadableDBObject, TableSource):
 
         outtags.rel_members = relids if relids else None
 
-        # geometry
-        geom, render_geom = make_geometry(conn, members, self.ways, self.data)
+        # geometry and route
+        if member_data is None:
+            member_data = load_member_data(conn, members, self.ways, self.data,
+                                           with_geometry=True)
 
-        if geom is None:
+        route_info = self._assemble_route(obj.id, members, relids, member_data)
+
+        if route_info is None:
             return None
 
-        route_members = get_relation_objects(conn, members, self.ways, self.data)
-        assert len(route_members) > 0
-        route = build_route(route_members)
+        geom, render_geom, route_json, route_data, linear = route_info
 
         # find the country
         outtags.country = self._find_country(relids, geom)
@@ -303,24 +497,16 @@ class Routes(ThreadableDBObject, TableSource):
             outtags.network = 'NDS'
 
         if 'network' in tags and not is_node_network:
-            h = self.rtree.data
-            r = self.rels.data
-            sel = sa.select(sa.text("'a'"))\
-                    .where(h.c.child == obj.id)\
-                    .where(r.c.id == h.c.parent)\
-                    .where(h.c.depth == 2)\
-                    .where(r.c.tags['network'].astext == tags['network'])\
-                    .limit(1)
-
-            top = self.thread.conn.scalar(sel)
-
-            outtags.top = (top is None)
+            # A route is not on top when it has a parent of the same network.
+            outtags.top = tags['network'] not in self.parent_networks.get(obj.id, ())
 
         outtags = dataclasses.asdict(outtags)
-        outtags['geom'] = geom
-        outtags['render_geom'] = render_geom
-        outtags['route'] = route.to_json()
-        outtags['linear'] = route.get_linear_state()
+        srid = self.c.geom.type.srid
+        outtags['geom'] = from_shape(geom, srid=srid)
+        outtags['render_geom'] = from_shape(render_geom, srid=srid)
+        outtags['route'] = route_json
+        outtags['route_data'] = route_data
+        outtags['linear'] = linear
         outtags['tags'] = obj.tags
 
         return outtags
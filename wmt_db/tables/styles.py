@@ -3,15 +3,22 @@
 # This file is part of the Waymarked Trails Map Project
 # Copyright (C) 2018-2023 Sarah Hoffmann
 
+from hashlib import blake2b
+import threading
+
 import sqlalchemy as sa
 from geoalchemy2 import Geometry
 
 from osgende.common.table import TableSource
 from osgende.common.threads import ThreadableDBObject
 
+from ..common.route_cache import RouteCache, PreloadedRouteCache
+
 class StyleTable(ThreadableDBObject, TableSource):
     """ Generic way table with styling information.
     """
+    route_cache_size = 100000
+
     def __init__(self, meta, routes, segments, hierarchy, style_config, uptable):
         self.config = style_config
         srid = segments.srid
@@ -20,7 +27,8 @@ class StyleTable(ThreadableDBObject, TableSource):
                          sa.Column('id', sa.BigInteger,
                                    primary_key=True, autoincrement=False),
                          sa.Column('geom', Geometry('LINESTRING', srid=srid)),
-                         sa.Column('geom100', Geometry('LINESTRING', srid=srid))
+                         sa.Column('geom100', Geometry('LINESTRING', srid=srid)),
+                         sa.Column('style_hash', sa.BigInteger)
                          )
 
         self.config.add_columns(table)
@@ -37,13 +45,60 @@ class StyleTable(ThreadableDBObject, TableSource):
         self.uptable = uptable
 
         self.numthreads = meta.info.get('num_threads', 1)
+        self.batch_size = meta.info.get('batch_size') or 1
+        self.preload_routes = meta.info.get('preload_routes', False)
+        self.use_sql_style = meta.info.get('sql_style', False)
+        self.row_buffers = {}
+
+    def _create_route_cache(self, engine, preload=False):
+        columns = getattr(self.config, 'route_columns', None)
+        if preload:
+            self.route_cache = PreloadedRouteCache(self.rels.data, columns)
+            with engine.execution_options(stream_results=True).begin() as conn:
+                self.route_cache.preload(conn)
+        else:
+            self.route_cache = RouteCache(self.rels.data, columns,
+                                          max_size=self.route_cache_size)
 
-    def construct(self, engine):
-        self.route_cache = {}
-        self.synchronize_ways(engine)
+    def _drop_route_cache(self):
+        self.route_cache.log_statistics()
         del self.route_cache
+
+    def construct(self, engine):
+        if not self.construct_in_database(engine):
+            self._create_route_cache(engine, preload=self.preload_routes)
+            self.synchronize_ways(engine)
+            self._drop_route_cache()
         self.copy_geometries(engine)
 
+    def construct_in_database(self, engine):
+        """ Compute the style columns for the segments with a single
+            SQL statement. Only possible when enabled and when the style
+            config can provide the SQL. Segments left out by the SQL are
+            computed in Python afterwards. Rows computed in SQL have no
+            style hash, it is filled in when the segment is updated.
+            Returns False when the table needs to be computed in Python
+            completely instead.
+        """
+        if not self.use_sql_style or not hasattr(self.config, 'construct_sql'):
+            return False
+
+        sql = self.config.construct_sql(self._synchronise_sql().subquery(),
+                                        self.rels.data)
+        if sql is None:
+            return False
+
+        with engine.begin() as conn:
+            self.truncate(conn)
+            conn.execute(self.data.insert().from_select(
+                             [self.c[c.name] for c in sql.selected_columns], sql))
+
+        self._create_route_cache(engine, preload=self.preload_routes)
+        self.synchronize_ways(engine, ~sa.exists().where(self.c.id == self.ways.c.id))
+        self._drop_route_cache()
+
+        return True
+
     def before_update(self, engine):
         # save all old geometries that will be deleted
         sql = sa.select(self.c.geom)\
@@ -51,13 +106,13 @@ class StyleTable(ThreadableDBObject, TableSource):
         self.uptable.add_from_select(engine, sql)
 
     def update(self, engine):
-        self.route_cache = {}
+        self._create_route_cache(engine)
         with engine.begin() as conn:
             conn.execute(self.data.delete()
                              .where(self.c.id.in_(self.ways.select_delete())))
         self.synchronize_ways(engine, self.ways.c.id.in_(self.ways.select_add_modify()))
         self.synchronize_rels(engine)
-        del self.route_cache
+        self._drop_route_cache()
         self.copy_geometries(engine)
 
     def after_update(self, engine):
@@ -72,8 +127,6 @@ class StyleTable(ThreadableDBObject, TableSource):
         if subset is not None:
             sql = sql.where(subset)
 
-        route_sql = sa.select(*(c for c in self.rels.c if c.name != 'geom'))
-
         with engine.begin() as conn:
             workers = self.create_worker_queue(engine, self._process_construct_next)
             cache_todo = set()
@@ -81,16 +134,18 @@ class StyleTable(ThreadableDBObject, TableSource):
 
             with engine.execution_options(stream_results=True).begin() as wconn:
                 for obj in wconn.execute(sql):
-                    # build cache in the main thread, so that workers only read
-                    cache_todo.update([x for x in obj.rels
-                                       if x not in self.route_cache])
+                    # fill the cache in the main thread, so that workers
+                    # only need to go to the database for evicted routes
+                    cache_todo.update(self.route_cache.missing(obj.rels))
+                    if not cache_todo:
+                        # all routes known, e.g. when preloaded
+                        workers.add_task(obj)
+                        continue
                     workers_todo.append(obj)
                     # We don't want an extra query for each relation, so collect
                     # a couple of todos.
                     if len(cache_todo) > 20:
-                        subres = conn.execute(route_sql.where(self.rels.c.id.in_(cache_todo)))
-                        for route in subres:
-                            self.route_cache[route.id] = route
+                        self.route_cache.load(conn, cache_todo)
                         for w in workers_todo:
                             workers.add_task(w)
                         cache_todo = set()
@@ -98,15 +153,18 @@ class StyleTable(ThreadableDBObject, TableSource):
 
             # add the remaining stuff
             if cache_todo:
-                subres = conn.execute(route_sql.where(self.rels.c.id.in_(cache_todo)))
-                for route in subres:
-                    self.route_cache[route.id] = route
+                self.route_cache.load(conn, cache_todo)
 
             for w in workers_todo:
                 workers.add_task(w)
 
             workers.finish()
 
+            # write out what is left in the buffers of the worker threads
+            for rows in self.row_buffers.values():
+                self._write_rows(conn, rows)
+            self.row_buffers = {}
+
     def synchronize_rels(self, engine):
         # select ways with changed rels joined with data with geom not null
         hd = self.rtree.change
@@ -117,24 +175,19 @@ class StyleTable(ThreadableDBObject, TableSource):
               .where(hd.c.parent == sa.func.any(sa.select(self.rels.change.c.id).scalar_subquery()))
         )
 
-        sql = self._synchronise_sql([c for c in self.c
-                                     if c.name not in ('id', 'geom')])\
+        sql = self._synchronise_sql([self.c.style_hash])\
                 .where(self.ways.c.rels.op('&& ARRAY')(relset.scalar_subquery()))\
                 .where(self.ways.c.id == self.c.id)\
                 .where(self.c.geom is not None)
 
-        route_sql = sa.select(*(c for c in self.rels.c if c.name != 'geom'))
-
         with engine.begin() as conn:
             workers = self.create_worker_queue(engine, self._process_rel_segment)
 
             with engine.execution_options(stream_results=True).begin() as wconn:
                 for obj in wconn.execute(sql):
-                    missing = [x for x in obj.rels if x not in self.route_cache]
+                    missing = self.route_cache.missing(obj.rels)
                     if missing:
-                        subres = conn.execute(route_sql.where(self.rels.c.id.in_(missing)))
-                        for route in subres:
-                            self.route_cache[route.id] = route
+                        self.route_cache.load(conn, missing)
                     workers.add_task(obj)
 
             workers.finish()
@@ -166,48 +219,63 @@ class StyleTable(ThreadableDBObject, TableSource):
 
 
     def _process_construct_next(self, obj):
-        cols = self._construct_row(obj)
-        self.thread.conn.execute(self.upsert_data().values(cols))
+        # Rows are collected per thread and written with a single
+        # upsert statement once 'batch_size' rows are together.
+        rows = self.row_buffers.setdefault(threading.get_ident(), [])
+        rows.append(self._construct_row(obj))
+        if len(rows) >= self.batch_size:
+            self._write_rows(self.thread.conn, rows)
+
+    def _write_rows(self, conn, rows):
+        if rows:
+            conn.execute(self.upsert_data().values(rows))
+            rows.clear()
 
 
     def _process_rel_segment(self, obj):
         cols = self._construct_row(obj, extra_data=False)
 
-        for k, v in cols.items():
-            objval = obj._mapping[k]
-            if v is None:
-                if objval is None:
-                    continue
-                else:
-                    break
-            if v is not None and objval is None:
-                break
-            if isinstance(v, list):
-                if set(v) != set(objval):
-                    break
-            else:
-                if v != objval:
-                    break
-        else:
+        # Segments created in SQL have no hash yet. They are rewritten
+        # once, which fills in the hash.
+        if cols['style_hash'] == obj.style_hash:
             return
 
-        self.thread.conn.execute(self.data.update().values(cols)
-                                     .where(self.data.c.id == obj.id))
-        self.uptable.add(self.thread.conn, obj.geom100)
+        geom = self.thread.conn.scalar(self.data.update().values(cols)
+                                           .where(self.data.c.id == obj.id)
+                                           .returning(self.data.c.geom100))
+        self.uptable.add(self.thread.conn, geom)
 
 
     def _construct_row(self, obj, extra_data=True):
         seginfo = self.config.new_collector()
         for rel in obj.rels:
-            if rel not in self.route_cache:
+            route = self.route_cache.get(self.thread.conn, rel)
+            if route is None:
                 print("Warning: no information for relation", rel)
             else:
-                self.config.add_to_collector(seginfo, self.route_cache[rel])
+                self.config.add_to_collector(seginfo, route)
 
         outdata = self.config.to_columns(seginfo)
+        outdata['style_hash'] = _style_hash(outdata)
         if extra_data:
             outdata['id'] = obj.id
             outdata['geom'] = None
             outdata['geom100'] = None
 
         return outdata
+
+
+def _canonical(value):
+    # Lists in the style columns are compared as sets.
+    if isinstance(value, (list, set, tuple)):
+        return sorted(set(map(repr, value)))
+    return repr(value)
+
+
+def _style_hash(columns):
+    """ Compute a 64-bit hash over the given style columns. The order of
+        the columns and the order of list contents do not matter.
+    """
+    data = repr([(k, _canonical(v)) for k, v in sorted(columns.items())])
+    return int.from_bytes(blake2b(data.encode('utf-8'), digest_size=8).digest(),
+                          'little', signed=True)